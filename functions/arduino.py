@@ -0,0 +1,137 @@
+import time as t
+import iot_api_client as iot
+from iot_api_client.rest import ApiException
+from iot_api_client.configuration import Configuration
+from iot_api_client.api import PropertiesV2Api, DevicesV2Api
+from oauthlib.oauth2 import BackendApplicationClient
+from requests_oauthlib import OAuth2Session
+from consts import *
+from database import fix_param_types
+
+
+def get_token():
+    """
+    Get the token for the Arduino Cloud API.
+    """
+    oauth_client = BackendApplicationClient(client_id=ARDUINO_CLIENT_ID)
+    token_url = "https://api2.arduino.cc/iot/v1/clients/token"
+    oauth = OAuth2Session(client=oauth_client)
+    token = oauth.fetch_token(
+        token_url=token_url,
+        client_id=ARDUINO_CLIENT_ID,
+        client_secret=ARDUINO_CLIENT_SECRET,
+        include_client_id=True,
+        audience="https://api2.arduino.cc/iot",
+    )
+    return token.get("access_token")
+
+
+def getDeviceParamFromIoTCloud(
+    thing_id: str, property_name: str, property_list: list
+) -> float:
+    try:
+        for property in property_list:
+            if property.name == property_name:
+                return property.last_value
+        return None
+
+    except ApiException as e:  # rate limit hit
+        if e.status == 429:
+            t.sleep(1)
+            return getDeviceParamFromIoTCloud(thing_id, property_name, property_list)
+        print(f"API Exception for {thing_id}: {str(e)}")
+        raise
+
+
+def getDeviceStatus(thing_id: str, devices_list: list) -> str:
+    for device in devices_list:
+        if device.thing and device.thing.id == thing_id:
+            return device.device_status
+
+    return "UNKNOWN"
+
+
+def getCurrentValues(params: dict, thing_id: str, property_list: list) -> dict:
+    current_values = {}
+
+    for key, property_name in params.items():
+        if key in ["type", "name", "thing_id"]:
+            current_values[key] = property_name
+        else:
+            new_value = getDeviceParamFromIoTCloud(
+                thing_id, property_name, property_list
+            )
+            current_values[key] = new_value
+
+    fix_param_types(current_values)
+    return current_values
+
+
+def normalizeState(state: str) -> str:
+    if state == "True" or state == True:
+        return "on"
+    elif state == "False" or state == False:
+        return "off"
+    return state
+
+
+def getPropertyListForThingId(thing_id: str, properties_api: PropertiesV2Api) -> list:
+    try:
+        properties = properties_api.properties_v2_list(id=thing_id)
+        return properties
+    except ApiException as e:
+        if e.status == 429:  # rate limit hit
+            t.sleep(1)
+            return getPropertyListForThingId(thing_id, properties_api)
+        raise
+
+
+def initIoTAPI(trace=None):
+    """
+    Set up the IoT Cloud clients. If a telemetry.Trace is passed, the token fetch
+    and device listing are recorded as separate stages.
+    """
+    try:
+        # config iot
+        host = "https://api2.arduino.cc"
+        client_config = Configuration(host)
+        stage_start = t.perf_counter()
+        client_config.access_token = get_token()
+        if trace is not None:
+            trace.record("token_fetch", t.perf_counter() - stage_start)
+        client = iot.ApiClient(client_config)
+        properties_api = PropertiesV2Api(client)
+        devices_api = DevicesV2Api(client)
+        stage_start = t.perf_counter()
+        devices = devices_api.devices_v2_list()
+        if trace is not None:
+            trace.record("device_list", t.perf_counter() - stage_start)
+        return properties_api, devices
+    except ApiException as e:  # rate limit hit
+        t.sleep(1)
+        return initIoTAPI(trace)
+
+
+def setSleepModeForThing(thing_id: str, sleep_value: bool):
+    try:
+        properties_api, devices = initIoTAPI()
+        properties = properties_api.properties_v2_list(id=thing_id)
+        sleep_property_id = None
+        for prop in properties:
+            if prop.name == "sleep":
+                sleep_property_id = prop.id
+                break
+        if sleep_property_id:
+            property_value = {"value": sleep_value}
+            print(
+                f"Setting sleep mode to {sleep_value} for {thing_id} to {sleep_value}"
+            )
+            properties_api.properties_v2_publish(
+                thing_id, sleep_property_id, property_value
+            )
+    except ApiException as e:
+        t.sleep(1)
+        setSleepModeForThing(thing_id, sleep_value)
+    except Exception as e:
+        print(f"Error setting sleep mode for {thing_id}: {e}")
+        raise
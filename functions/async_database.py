@@ -0,0 +1,109 @@
+import asyncio
+import threading
+from consts import *
+from sql_metrics import instrument_engine
+from telemetry import current_endpoint, reset_endpoint, set_endpoint
+
+async_engine = None
+async_connector = None
+
+_loop = None
+_loop_lock = threading.Lock()
+_engine_lock = None
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the process wide event loop that owns the async engine.
+
+    The loop runs forever in a daemon thread so the pool and its connections
+    survive between requests, which are served from Flask worker threads.
+    """
+    global _loop
+
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="async-db-loop", daemon=True
+            ).start()
+    return _loop
+
+
+def run_async(coro):
+    """
+    Run a coroutine on the shared event loop and block until it finishes.
+    """
+    # tasks on the loop thread don't inherit the caller's context, so carry the
+    # endpoint over for the SQL metrics
+    endpoint = current_endpoint()
+
+    async def with_endpoint():
+        token = set_endpoint(endpoint)
+        try:
+            return await coro
+        finally:
+            reset_endpoint(token)
+
+    return asyncio.run_coroutine_threadsafe(with_endpoint(), get_event_loop()).result()
+
+
+async def init_async_db_connection():
+    """
+    Initialize the asyncpg engine using a single global async Connector instance,
+    or connect straight to DB_URL when it is set. The async path only serves reads,
+    so it goes to the read replica when one is configured.
+    """
+    global async_engine, async_connector, _engine_lock
+
+    if _engine_lock is None:
+        _engine_lock = asyncio.Lock()
+
+    if DB_READ_URL or DB_READ_INSTANCE_NAME:
+        url, instance_name = DB_READ_URL, DB_READ_INSTANCE_NAME
+    else:
+        url, instance_name = DB_URL, DB_INSTANCE_NAME
+    server_settings = {"statement_timeout": str(READ_STATEMENT_TIMEOUT_MS)}
+
+    async with _engine_lock:
+        # Only create the connector and connection pool once
+        if async_engine is None and url:
+            from sqlalchemy.engine import make_url
+            from sqlalchemy.ext.asyncio import create_async_engine
+
+            # same database as the sync read engine, through the asyncpg driver
+            async_engine = create_async_engine(
+                make_url(url).set(drivername="postgresql+asyncpg"),
+                connect_args={"server_settings": server_settings},
+                pool_size=ASYNC_POOL_SIZE,
+                max_overflow=ASYNC_MAX_OVERFLOW,
+                pool_timeout=30,
+                pool_recycle=1800,
+            )
+        elif async_engine is None:
+            from google.cloud.sql.connector import IPTypes, create_async_connector
+            from sqlalchemy.ext.asyncio import create_async_engine
+
+            async_connector = await create_async_connector(refresh_strategy="LAZY")
+
+            async def _connect():
+                return await async_connector.connect_async(
+                    instance_name,
+                    "asyncpg",
+                    user=DB_USER,
+                    password=DB_PASS,
+                    db=DB_NAME,
+                    ip_type=IPTypes.PUBLIC,
+                    server_settings=server_settings,
+                )
+
+            async_engine = create_async_engine(
+                "postgresql+asyncpg://",
+                async_creator=_connect,
+                pool_size=ASYNC_POOL_SIZE,
+                max_overflow=ASYNC_MAX_OVERFLOW,
+                pool_timeout=30,
+                pool_recycle=1800,
+            )
+        instrument_engine(async_engine.sync_engine)
+    return async_engine
@@ -0,0 +1,93 @@
+import asyncio
+from sqlalchemy import text
+from async_database import init_async_db_connection
+from queries import (
+    LAST_LAT_QUERY,
+    LAST_LONG_QUERY,
+    LAST_USED_TIME_FORMAT,
+    LAST_USED_TIME_QUERY,
+    MOST_RECENT_VAR_QUERY,
+)
+
+# variables returned for every machine by getMachineSnapshot
+SNAPSHOT_VARIABLES = ["state", "type", "device_status"]
+
+
+async def fetchMostRecentVarFromDbAsync(
+    thing_id: str, variable: str, table_name: str
+) -> list:
+    try:
+        engine = await init_async_db_connection()
+        query = MOST_RECENT_VAR_QUERY.format(variable=variable, table_name=table_name)
+        async with engine.connect() as conn:
+            result = await conn.execute(text(query), {"machine": thing_id})
+            return [
+                {variable: row[0], "timestamp": row[1].isoformat()} for row in result
+            ]
+    except Exception as e:
+        print(f"Error fetching from db: {e}")
+        raise
+
+
+async def getLastLatAsync(thing_id: str) -> float:
+    try:
+        engine = await init_async_db_connection()
+        async with engine.connect() as conn:
+            result = await conn.execute(text(LAST_LAT_QUERY), {"thing_id": thing_id})
+            return result.scalar()
+    except Exception as e:
+        print(f"Error fetching last lat for {thing_id}: {e}")
+        return None
+
+
+async def getLastLongAsync(thing_id: str) -> float:
+    try:
+        engine = await init_async_db_connection()
+        async with engine.connect() as conn:
+            result = await conn.execute(text(LAST_LONG_QUERY), {"thing_id": thing_id})
+            return result.scalar()
+    except Exception as e:
+        print(f"Error fetching last long for {thing_id}: {e}")
+        return None
+
+
+async def getLastUsedTimeAsync(thing_id: str) -> str:
+    try:
+        engine = await init_async_db_connection()
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                text(LAST_USED_TIME_QUERY), {"thing_id": thing_id}
+            )
+            return result.scalar().strftime(LAST_USED_TIME_FORMAT)
+    except Exception as e:
+        print(f"Error fetching last used time for {thing_id}: {e}")
+        return None
+
+
+async def getMachineSnapshotAsync(thing_id: str) -> dict:
+    """
+    Everything the map needs for one machine, with every lookup run concurrently.
+    """
+    *variables, lat, long, last_used_time = await asyncio.gather(
+        *(
+            fetchMostRecentVarFromDbAsync(thing_id, variable, "machine_states")
+            for variable in SNAPSHOT_VARIABLES
+        ),
+        getLastLatAsync(thing_id),
+        getLastLongAsync(thing_id),
+        getLastUsedTimeAsync(thing_id),
+    )
+
+    snapshot = {"thing_id": thing_id}
+    for variable, rows in zip(SNAPSHOT_VARIABLES, variables):
+        snapshot[variable] = rows[0][variable] if rows else None
+    snapshot["lat"] = lat
+    snapshot["long"] = long
+    snapshot["last_used_time"] = last_used_time
+    return snapshot
+
+
+async def getMachineSnapshotsAsync(thing_ids: list) -> list:
+    return await asyncio.gather(
+        *(getMachineSnapshotAsync(thing_id) for thing_id in thing_ids)
+    )
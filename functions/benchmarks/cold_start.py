@@ -0,0 +1,111 @@
+"""
+Cold start import benchmark for the Cloud Functions entry points.
+
+Every entry point is measured in a fresh interpreter: first `import main` (what
+every function pays), then the modules that handler imports lazily, found by
+reading the import statements inside its body in main.py.
+
+Usage (from the functions directory):
+    python benchmarks/cold_start.py [--runs 5] [--function getLat ...]
+"""
+
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_PATH = os.path.join(FUNCTIONS_DIR, "main.py")
+
+# runs in a child interpreter so nothing is cached between measurements
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+main_done = time.perf_counter()
+for statement in json.loads(sys.argv[1]):
+    exec(statement)
+end = time.perf_counter()
+print(json.dumps({
+    "main_ms": (main_done - start) * 1000,
+    "handler_ms": (end - main_done) * 1000,
+    "modules": len(sys.modules),
+}))
+"""
+
+
+def entry_point_imports(path: str = MAIN_PATH) -> dict:
+    """
+    Map every decorated function in main.py to the import statements in its body.
+    """
+    with open(path) as f:
+        tree = ast.parse(f.read())
+
+    entry_points = {}
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.decorator_list:
+            entry_points[node.name] = [
+                ast.unparse(child)
+                for child in ast.walk(node)
+                if isinstance(child, (ast.Import, ast.ImportFrom))
+            ]
+    return entry_points
+
+
+def measure(imports: list, runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE, json.dumps(imports)],
+            cwd=FUNCTIONS_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    return {
+        "main_ms": statistics.median(s["main_ms"] for s in samples),
+        "handler_ms": statistics.median(s["handler_ms"] for s in samples),
+        "total_ms": statistics.median(s["main_ms"] + s["handler_ms"] for s in samples),
+        "modules": samples[-1]["modules"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--function", action="append", dest="functions")
+    parser.add_argument("--json", action="store_true", help="print raw JSON")
+    args = parser.parse_args()
+
+    entry_points = entry_point_imports()
+    names = args.functions or sorted(entry_points)
+
+    results = {}
+    for name in names:
+        try:
+            results[name] = measure(entry_points[name], args.runs)
+        except subprocess.CalledProcessError as e:
+            results[name] = {"error": e.stderr.strip().splitlines()[-1]}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'entry point':<24}{'main':>10}{'handler':>10}{'total':>10}{'modules':>9}")
+    for name, result in results.items():
+        if "error" in result:
+            print(f"{name:<24}  {result['error']}")
+            continue
+        print(
+            f"{name:<24}{result['main_ms']:>8.1f}ms{result['handler_ms']:>8.1f}ms"
+            f"{result['total_ms']:>8.1f}ms{result['modules']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
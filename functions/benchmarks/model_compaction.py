@@ -0,0 +1,125 @@
+"""
+Benchmark of the compacted, flattened forest against the scikit-learn model.
+
+Trains RandomForestModel on synthetic minute data with and without compaction,
+then compares artifact size, load time and prediction latency of the pickled
+scikit-learn forest against the FlatForest node arrays, and checks the
+probabilities match.
+
+Usage (from the functions directory):
+    python benchmarks/model_compaction.py [--rows 2000000] [--devices 50]
+"""
+
+import argparse
+import os
+import pickle
+import subprocess
+import sys
+import time
+import warnings
+
+import numpy as np
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FUNCTIONS_DIR)
+
+import model as model_module  # noqa: E402
+from benchmarks.training_prep import make_samples  # noqa: E402
+from flat_forest import FlatForest  # noqa: E402
+from model import RandomForestModel, aggregate_slots  # noqa: E402
+
+
+def timed(func, *args, repeat: int = 1) -> tuple:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(*args)
+    return result, (time.perf_counter() - start) / repeat
+
+
+def import_seconds(module: str) -> float:
+    # in a fresh interpreter, so nothing is imported already
+    code = (
+        "import sys, time; sys.path.insert(0, sys.argv[1]); start = time.perf_counter()"
+        f"; import {module}; print(time.perf_counter() - start)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code, FUNCTIONS_DIR], capture_output=True, text=True
+    )
+    return float(result.stdout.strip())
+
+
+def train(slots, compact: bool) -> tuple:
+    model_module.COMPACT_MODEL = compact
+    model = RandomForestModel(load_model=False)
+    acc, seconds = timed(model.fit, slots)
+    return model, acc, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--devices", type=int, default=50)
+    args = parser.parse_args()
+    # the benchmark passes plain arrays to the forest fitted on a DataFrame
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
+    slots = aggregate_slots(make_samples(args.rows, args.devices))
+    print(f"{len(slots):,} slots, {args.devices} devices")
+
+    full, full_acc, full_seconds = train(slots, compact=False)
+    compact, compact_acc, compact_seconds = train(slots, compact=True)
+    print(f"unbounded  accuracy {full_acc:.4f}  fit {full_seconds:6.2f}s")
+    print(
+        f"compacted  accuracy {compact_acc:.4f}  fit {compact_seconds:6.2f}s  "
+        f"min_samples_leaf={compact.model.min_samples_leaf}"
+    )
+
+    for module in ["sklearn.ensemble", "flat_forest"]:
+        print(f"import {module:<17}{import_seconds(module) * 1000:8.0f}ms")
+
+    # every (thing, hour, minute, day of week) input, like the occupancy table; a
+    # day of one machine's slots is a getPeakHours sized request
+    grid = np.stack(
+        np.meshgrid(np.arange(args.devices), np.arange(24), [0, 30], np.arange(7)),
+        axis=-1,
+    ).reshape(-1, 4)
+    single, day = grid[:1], grid[:48]
+
+    print()
+    print(
+        f"{'artifact':<22}{'nodes':>9}{'size KB':>10}{'load ms':>10}"
+        f"{'1 row ms':>10}{'48 rows ms':>11}{f'{len(grid)} rows ms':>16}"
+    )
+    for label, model in [("unbounded", full), ("compacted", compact)]:
+        data = model.to_bytes()
+        loaded, load_seconds = timed(pickle.loads, data, repeat=3)
+        forest = loaded["model"]
+        _, row_seconds = timed(forest.predict_proba, single, repeat=20)
+        _, day_seconds = timed(forest.predict_proba, day, repeat=20)
+        _, grid_seconds = timed(forest.predict_proba, grid, repeat=3)
+        nodes = sum(tree.tree_.node_count for tree in forest.estimators_)
+        print(
+            f"{label + ' sklearn':<22}{nodes:>9,}{len(data) / 1024:>10.0f}"
+            f"{load_seconds * 1000:>10.1f}{row_seconds * 1000:>10.2f}"
+            f"{day_seconds * 1000:>11.2f}{grid_seconds * 1000:>16.1f}"
+        )
+
+        data = model.flat_forest().to_bytes()
+        flat, load_seconds = timed(FlatForest.from_bytes, data, repeat=3)
+        _, row_seconds = timed(flat.predict_proba, single, repeat=20)
+        _, day_seconds = timed(flat.predict_proba, day, repeat=20)
+        _, grid_seconds = timed(flat.predict_proba, grid, repeat=3)
+        print(
+            f"{label + ' flat':<22}{flat.n_nodes:>9,}{len(data) / 1024:>10.0f}"
+            f"{load_seconds * 1000:>10.1f}{row_seconds * 1000:>10.2f}"
+            f"{day_seconds * 1000:>11.2f}{grid_seconds * 1000:>16.1f}"
+        )
+
+        difference = np.abs(
+            flat.predict_proba(grid) - forest.predict_proba(grid)
+        ).max()
+        print(f"{'':<22}max probability difference {difference}")
+
+
+if __name__ == "__main__":
+    main()
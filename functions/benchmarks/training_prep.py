@@ -0,0 +1,107 @@
+"""
+Benchmark of RandomForestModel training data preparation.
+
+Builds raw minute-level samples (thing_id, state, timestamp) for a number of
+devices, ordered by timestamp, then times the vectorized _prepare_slots against
+the previous per-row implementation and checks both produce the same slots.
+
+Usage (from the functions directory):
+    python benchmarks/training_prep.py [--rows 2000000] [--devices 50] [--skip-legacy]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FUNCTIONS_DIR)
+
+from model import RandomForestModel, extract_features  # noqa: E402
+from sklearn.preprocessing import LabelEncoder  # noqa: E402
+
+
+def make_samples(rows: int, devices: int, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    minutes = rows // devices
+    timestamps = pd.date_range("2024-01-01", periods=minutes, freq="min")
+    hours = timestamps.hour.to_numpy()
+    busy = 0.15 + 0.5 * ((hours >= 16) & (hours <= 19))
+    thing_ids = [f"device-{i:03d}" for i in range(devices)]
+
+    on = rng.random((minutes, devices)) < busy[:, None]
+    return pd.DataFrame(
+        {
+            "thing_id": np.tile(np.array(thing_ids, dtype=object), minutes),
+            "state": np.where(on.ravel(), "on", "off").astype(object),
+            "timestamp": np.repeat(timestamps.to_numpy(), devices),
+        }
+    )
+
+
+def legacy_prepare(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    The previous per-row preparation, up to the encoded slot table.
+    """
+    df = extract_features(df)
+    df["hour_slot"] = df["timestamp"].dt.floor("30min")
+    df["hour_slot"] = df["hour_slot"].apply(
+        lambda x: x.replace(minute=0) if x.minute < 30 else x.replace(minute=30)
+    )
+    df = (
+        df.groupby(["thing_id", "hour_slot"])
+        .agg(
+            {
+                "state": lambda x: "on" if "on" in x.values else "off",
+                "hour": "first",
+                "minute": "first",
+                "day_of_week": "first",
+            }
+        )
+        .reset_index()
+    )
+    df["encoded_state"] = LabelEncoder().fit_transform(df["state"])
+    df["encoded_thing_id"] = LabelEncoder().fit_transform(df["thing_id"])
+    return df
+
+
+def timed(func, *args) -> tuple:
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    df = make_samples(args.rows, args.devices)
+    print(f"{len(df):,} rows, {args.devices} devices")
+
+    model = RandomForestModel(load_model=False)
+    slots, seconds = timed(model._prepare_slots, df.copy())
+    print(f"vectorized  {seconds:8.2f}s  {len(slots):,} slots")
+
+    if args.skip_legacy:
+        return
+
+    legacy, legacy_seconds = timed(legacy_prepare, df.copy())
+    print(f"legacy      {legacy_seconds:8.2f}s  {len(legacy):,} slots")
+    print(f"speedup     {legacy_seconds / seconds:8.1f}x")
+
+    columns = ["encoded_thing_id", "hour", "minute", "day_of_week", "encoded_state"]
+    matches = all(
+        np.array_equal(slots[column].to_numpy(), legacy[column].to_numpy())
+        for column in columns
+    )
+    print(f"same slots  {matches}")
+
+
+if __name__ == "__main__":
+    main()
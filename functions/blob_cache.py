@@ -0,0 +1,78 @@
+import threading
+import time as t
+from clients import get_storage_client
+from consts import *
+from request_metrics import record_cache
+
+
+class BlobCache:
+    """
+    Process-level cache of an object built from a Cloud Storage blob.
+
+    The blob's generation is checked (a metadata request) at most every
+    check_interval seconds. The blob is only downloaded again when the generation
+    changed, and the new object is swapped in with a single reference assignment so
+    requests in flight keep using the one they started with.
+    """
+
+    def __init__(
+        self,
+        bucket_name,
+        blob_name,
+        loader,
+        check_interval: float = MODEL_CHECK_INTERVAL_SECONDS,
+    ):
+        # bucket and blob names are callables so env vars are read on first use
+        self.bucket_name = bucket_name
+        self.blob_name = blob_name
+        self.loader = loader
+        self.check_interval = check_interval
+        self._entry = None  # (generation, object)
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _is_fresh(self) -> bool:
+        return t.monotonic() - self._checked_at < self.check_interval
+
+    def get(self):
+        entry = self._entry
+        if entry is not None and self._is_fresh():
+            record_cache(True)
+            return entry[1]
+
+        # while one request refreshes, the others keep serving the current object
+        if not self._lock.acquire(blocking=entry is None):
+            record_cache(True)
+            return entry[1]
+        try:
+            if self._entry is not None and self._is_fresh():
+                record_cache(True)
+                return self._entry[1]
+            return self._refresh()
+        finally:
+            self._lock.release()
+
+    def _refresh(self):
+        blob_name = self.blob_name()
+        entry = self._entry
+        try:
+            bucket = get_storage_client().bucket(self.bucket_name())
+            blob = bucket.get_blob(blob_name)
+            if blob is None:
+                raise FileNotFoundError(f"{blob_name} not found")
+
+            if entry is None or blob.generation != entry[0]:
+                print(f"Loading {blob_name} generation {blob.generation}")
+                data = blob.download_as_bytes(if_generation_match=blob.generation)
+                self._entry = (blob.generation, self.loader(data))
+                record_cache(False)
+            else:
+                record_cache(True)
+        except Exception as e:
+            if entry is None:
+                raise
+            # keep serving the loaded object if the check fails
+            print(f"Error checking {blob_name} for a new version: {e}")
+            record_cache(True)
+        self._checked_at = t.monotonic()
+        return self._entry[1]
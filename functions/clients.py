@@ -0,0 +1,37 @@
+import threading
+
+_firestore_client = None
+_storage_client = None
+# first calls can race on threaded workers, initialize_app raises if run twice
+_lock = threading.Lock()
+
+
+def get_firestore():
+    """
+    Return the shared Firestore client, initializing the Firebase app on first use.
+    """
+    global _firestore_client
+
+    if _firestore_client is None:
+        with _lock:
+            if _firestore_client is None:
+                from firebase_admin import initialize_app, firestore
+
+                initialize_app()
+                _firestore_client = firestore.client()
+    return _firestore_client
+
+
+def get_storage_client():
+    """
+    Return the shared Cloud Storage client, creating it on first use.
+    """
+    global _storage_client
+
+    if _storage_client is None:
+        with _lock:
+            if _storage_client is None:
+                import google.cloud.storage as storage
+
+                _storage_client = storage.Client()
+    return _storage_client
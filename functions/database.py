@@ -0,0 +1,197 @@
+from datetime import datetime, timezone
+from sqlalchemy import create_engine, event, text
+from consts import *
+from sql_metrics import instrument_engine
+
+connection_pool = None
+read_connection_pool = None
+global_connector = None
+
+
+def _set_statement_timeout(engine, timeout_ms: int) -> None:
+    """
+    Apply a statement timeout to every new connection in the engine's pool.
+    """
+    if not timeout_ms:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_timeout(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"SET statement_timeout = {int(timeout_ms)}")
+        cursor.close()
+        # commit so the pool's rollback on checkin doesn't undo the SET
+        dbapi_connection.commit()
+
+
+def _create_engine(url, instance_name, pool_size, max_overflow, timeout_ms):
+    """
+    Create an engine for a SQLAlchemy URL, or for a Cloud SQL instance through the
+    shared Connector when no URL is given.
+    """
+    global global_connector
+
+    if url:
+        # local or test database, no Cloud SQL connector needed
+        engine = create_engine(
+            url,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=30,
+            pool_recycle=1800,
+        )
+    else:
+        from google.cloud.sql.connector import Connector, IPTypes
+
+        # Create a single global Connector instance
+        if global_connector is None:
+            global_connector = Connector(refresh_strategy="LAZY")
+
+        def _connect():
+            return global_connector.connect(
+                instance_name,
+                "pg8000",
+                user=DB_USER,
+                password=DB_PASS,
+                db=DB_NAME,
+                ip_type=IPTypes.PUBLIC,
+            )
+
+        engine = create_engine(
+            "postgresql+pg8000://",
+            creator=_connect,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=30,
+            pool_recycle=1800,
+        )
+    _set_statement_timeout(engine, timeout_ms)
+    instrument_engine(engine)
+    return engine
+
+
+def init_db_connection():
+    """
+    Initialize the write (primary) engine, either through the Cloud SQL Connector
+    or straight to DB_URL when it is set.
+    """
+    global connection_pool
+
+    # Only create the connection pool once
+    if connection_pool is None:
+        connection_pool = _create_engine(
+            DB_URL,
+            DB_INSTANCE_NAME,
+            WRITE_POOL_SIZE,
+            WRITE_MAX_OVERFLOW,
+            WRITE_STATEMENT_TIMEOUT_MS,
+        )
+    return connection_pool
+
+
+def init_read_db_connection():
+    """
+    Initialize the engine used by read-only helpers. It connects to the replica
+    in DB_READ_URL / DB_READ_INSTANCE_NAME when one is configured, otherwise to
+    the primary, but always through its own pool so analytics reads can't hold
+    up ingestion writes.
+    """
+    global read_connection_pool
+
+    if read_connection_pool is None:
+        if DB_READ_URL or DB_READ_INSTANCE_NAME:
+            url, instance_name = DB_READ_URL, DB_READ_INSTANCE_NAME
+        else:
+            url, instance_name = DB_URL, DB_INSTANCE_NAME
+        read_connection_pool = _create_engine(
+            url,
+            instance_name,
+            READ_POOL_SIZE,
+            READ_MAX_OVERFLOW,
+            READ_STATEMENT_TIMEOUT_MS,
+        )
+    return read_connection_pool
+
+
+def build_query_from_params(params: dict, table_name: str) -> str:
+    params = fix_param_types(params)
+    query = f"""
+        INSERT INTO {table_name} ({", ".join(params.keys())})
+        VALUES ({", ".join([f":{key}" for key in params.keys()])})
+    """
+    return query
+
+
+def to_timestamp(value) -> datetime:
+    """
+    Coerce a timestamp to an aware datetime so it is bound as a timestamptz.
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if not isinstance(value, datetime):
+        raise TypeError(f"not a timestamp: {value!r}")
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def fix_param_types(params: dict) -> dict:
+    types = {
+        "thing_id": str,
+        "state": str,
+        "timestamp": to_timestamp,
+        "analogOffset": float,
+        "alt": float,
+        "lat": float,
+        "long": float,
+        "rate": float,
+        "sampleNumber": int,
+        "smoothingFactor": float,
+        "smoothedrmsCurrent": float,
+        "threshold": float,
+        "type": str,
+        "name": str,
+        "rms": float,
+        "floor": int,
+    }
+
+    for key, value in params.items():
+        if key in types and value is not None:
+            try:
+                params[key] = types[key](value)
+            except (ValueError, TypeError):
+                print(
+                    f"Warning: Could not convert {key} value {value} to {types[key].__name__}"
+                )
+                params[key] = None
+
+    return params
+
+
+def write_state_to_db(params: dict, table_name: str) -> None:
+    """
+    Write the state of a device to the specified table.
+    """
+    try:
+        engine = init_db_connection()
+        query = build_query_from_params(params, table_name)
+
+        with engine.connect() as conn:
+            conn.execute(text(query), params)
+            conn.commit()
+
+    except Exception as e:
+        print(f"Error writing to db: {e}")
+        raise
+
+
+def test_connection():
+    try:
+        engine = init_db_connection()
+        with engine.connect() as conn:
+            result = conn.execute(text("SELECT 1"))
+            print("Database connection successful:", result.scalar())
+        return True
+    except Exception as e:
+        print("Connection failed:", str(e))
+        return False
@@ -0,0 +1,165 @@
+import io
+import numpy as np
+import pandas as pd
+
+
+class FlatForest:
+    """
+    A fitted RandomForestModel with every tree flattened into shared NumPy node
+    arrays, evaluated for all rows and trees at once without scikit-learn.
+    Loading and small batches are much cheaper than with the pickled forest, large
+    batches (thousands of rows) are faster through scikit-learn's compiled trees.
+
+    Nodes of all trees are concatenated; roots holds the index of each tree's root.
+    Leaves point to themselves so every row can take the same number of steps.
+    value holds each node's class probabilities, normalized like scikit-learn's
+    predict_proba, so probabilities match the forest exactly.
+    """
+
+    def __init__(
+        self,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        left: np.ndarray,
+        right: np.ndarray,
+        value: np.ndarray,
+        roots: np.ndarray,
+        depth: int,
+        thing_ids,
+        labels,
+    ):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.depth = depth
+        # child of node i is children[2 * i + went_left], one gather per level
+        self.children = np.stack([right, left], axis=1).ravel()
+        # classes of the thing_id and state encoders, sorted like LabelEncoder
+        self.thing_ids = np.asarray(thing_ids, dtype=str)
+        self.labels = np.asarray(labels, dtype=str)
+
+    @classmethod
+    def from_model(cls, model) -> "FlatForest":
+        """
+        Flatten a RandomForestModel's forest and encoders.
+        """
+        forest = model.model
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            leaf = tree.children_left == -1
+
+            features.append(np.where(leaf, 0, tree.feature))
+            thresholds.append(np.where(leaf, np.inf, tree.threshold))
+            lefts.append(np.where(leaf, nodes, tree.children_left) + offset)
+            rights.append(np.where(leaf, nodes, tree.children_right) + offset)
+
+            # the tree's classes are the forest's, one output
+            value = tree.value[:, 0, :].astype(np.float64)
+            normalizer = value.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0.0] = 1.0
+            values.append(value / normalizer)
+
+            roots.append(offset)
+            offset += tree.node_count
+
+        # the forest's classes are encoded labels, map them back to label names
+        labels = model.label_encoder.inverse_transform(forest.classes_.astype(int))
+        return cls(
+            np.concatenate(features).astype(np.int32),
+            np.concatenate(thresholds),
+            np.concatenate(lefts).astype(np.int32),
+            np.concatenate(rights).astype(np.int32),
+            np.concatenate(values),
+            np.array(roots, dtype=np.int32),
+            max(estimator.tree_.max_depth for estimator in forest.estimators_),
+            model.thing_id_encoder.classes_,
+            labels,
+        )
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.feature)
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            feature=self.feature,
+            threshold=self.threshold,
+            left=self.left,
+            right=self.right,
+            value=self.value,
+            roots=self.roots,
+            depth=np.array(self.depth),
+            thing_ids=self.thing_ids,
+            labels=self.labels,
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "FlatForest":
+        with np.load(io.BytesIO(data)) as arrays:
+            return cls(
+                arrays["feature"],
+                arrays["threshold"],
+                arrays["left"],
+                arrays["right"],
+                arrays["value"],
+                arrays["roots"],
+                int(arrays["depth"]),
+                arrays["thing_ids"],
+                arrays["labels"],
+            )
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """
+        Class probabilities for rows of (encoded_thing_id, hour, minute, day_of_week).
+        """
+        # scikit-learn compares float32 features against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        n_rows = len(X)
+        offsets = (np.arange(n_rows) * X.shape[1])[:, None]
+        X = X.ravel()
+
+        # walk every (row, tree) pair down one level per step
+        node = np.broadcast_to(self.roots, (n_rows, len(self.roots)))
+        for _ in range(self.depth):
+            go_left = X[offsets + self.feature[node]] <= self.threshold[node]
+            node = self.children[node * 2 + go_left]
+
+        # summed tree by tree in order, like the forest, so results match exactly
+        proba = np.zeros((n_rows, self.value.shape[1]))
+        for tree in range(len(self.roots)):
+            proba += self.value[node[:, tree]]
+        return proba / len(self.roots)
+
+    # predict the state of a machine at a given time, like RandomForestModel.predict
+    def predict(self, df: pd.DataFrame) -> pd.DataFrame:
+        result = df.copy()
+        result["timestamp"] = pd.to_datetime(result["timestamp"])
+        result["hour"] = result["timestamp"].dt.hour
+        result["minute"] = result["timestamp"].dt.minute
+        result["day_of_week"] = result["timestamp"].dt.dayofweek
+
+        # encode thing_id, unknown ones raise like LabelEncoder.transform
+        if "thing_id" in result.columns:
+            things = result["thing_id"].astype(str).to_numpy()
+            encoded = np.searchsorted(self.thing_ids, things)
+            known = encoded < len(self.thing_ids)
+            known[known] = self.thing_ids[encoded[known]] == things[known]
+            if not known.all():
+                raise ValueError(f"unseen thing_ids: {things[~known]}")
+            result["encoded_thing_id"] = encoded
+
+        # one pass over the forest gives both the state and its probability
+        X = result[["encoded_thing_id", "hour", "minute", "day_of_week"]].to_numpy()
+        probabilities = self.predict_proba(X)
+        result["predicted_state"] = self.labels[probabilities.argmax(axis=1)]
+        result["probability_on"] = probabilities[:, 1]  # Probability of being 'on'
+        return result
@@ -0,0 +1,268 @@
+from datetime import datetime, timezone, timedelta
+import time as t
+import statistics
+from iot_api_client.rest import ApiException
+from consts import *
+from clients import get_firestore
+from database import init_db_connection, write_state_to_db
+from arduino import getCurrentValues, getDeviceStatus, getPropertyListForThingId, initIoTAPI
+from telemetry import Trace
+
+
+def get_thing_id(machine):
+    """
+    Get the thing id for a machine from Firestore.
+    """
+    doc = get_firestore().collection("machines").document(machine).get()
+    if doc.exists:
+        data = doc.to_dict()
+        return str(data.get("thingId"))
+    print(f"{machine} does not have a corresponding doc in Firestore")
+    return None
+
+
+def fetch_params(thing_id: str) -> dict:
+    doc = get_firestore().collection("thing_ids").document(thing_id).get()
+
+    if doc.exists:
+        data = doc.to_dict()
+        return data
+    else:
+        print(f"Thing ID {thing_id} does not exist in Firestore")
+        return None
+
+
+def _device_counts(samples: dict, errors: dict) -> dict:
+    return {
+        thing_id: {"samples": samples[thing_id], "errors": errors[thing_id]}
+        for thing_id in samples
+    }
+
+
+def addTimeStepUtil() -> None:
+    trace = Trace("addTimeStep")
+    # per-device sample and error counts, logged with the summary
+    samples = {}
+    errors = {}
+    try:
+        start = t.time()
+        current_time = datetime.now(timezone.utc)
+        central_time = current_time.astimezone(timezone(timedelta(hours=-5)))
+        # machine_states stores Central wall clock time tagged as UTC (the frontend
+        # reads it that way), written as a typed timestamptz rather than a string
+        timestamp = central_time.replace(
+            microsecond=central_time.microsecond // 1000 * 1000, tzinfo=timezone.utc
+        )
+
+        with trace.span("db_connect"):
+            init_db_connection()
+        db = get_firestore()
+
+        with trace.span("firestore_reads") as span:
+            # thing ids from firebase
+            thing_ids = db.collection("thing_ids").list_documents()
+            thing_ids = [thing_id.id for thing_id in thing_ids]
+
+            # store original params (these contain the IoT property names to look up)
+            original_params = {
+                thing_id: fetch_params(thing_id) for thing_id in thing_ids
+            }
+            span["devices"] = len(thing_ids)
+
+        # init iot api
+        with trace.span("iot_init"):
+            properties_api, devices = initIoTAPI(trace)
+
+        samples = {thing_id: 0 for thing_id in thing_ids}
+        errors = {thing_id: 0 for thing_id in thing_ids}
+        max_values = {}
+        value_counts = {}
+        on_off_dict = {}
+        n = 0
+
+        # these are string params that we want to count the number of times they appear instead of mode value
+        string_params = [
+            "state",
+            "machineName",
+            "device_status",
+            "name",
+            "thing_id",
+            "type",
+        ]
+
+        def takeSample(thing_id: str, thing_id_params: dict, property_list: list):
+            """
+            This function takes a single sample of every parameter defined in IoT Cloud for a given thing_id (device)
+            """
+            try:
+                current_values = getCurrentValues(
+                    thing_id_params, thing_id, property_list
+                )
+            except ApiException as e:  # rate limit hit
+                t.sleep(1)
+                return takeSample(thing_id, thing_id_params, property_list)
+            except Exception as e:  # other error
+                errors[thing_id] += 1
+                return None
+            return current_values
+
+        with trace.span("sampling") as sampling:
+            while t.time() - start < SAMPLE_TIME:
+                for thing_id in thing_ids:
+                    # get params to sample
+                    thing_id_params = original_params[thing_id]
+
+                    # initialize counts and values if this is first sample
+                    if thing_id not in value_counts:
+                        value_counts[thing_id] = {}
+                        max_values[thing_id] = {}
+
+                        value_counts[thing_id] = {
+                            param: {} for param in thing_id_params.keys()
+                        }
+                        max_values[thing_id] = {
+                            param: 0 for param in thing_id_params.keys()
+                        }
+
+                        # this is for testing but track in db for now
+                        on_off_dict[thing_id] = {
+                            param: {"on": 0, "off": 0}
+                            for param in thing_id_params.keys()
+                        }
+
+                    # get parameters and corresponding IoT thing properties
+                    stage_start = t.perf_counter()
+                    property_list = getPropertyListForThingId(thing_id, properties_api)
+                    trace.record("property_list", t.perf_counter() - stage_start)
+
+                    # take sample
+                    stage_start = t.perf_counter()
+                    sample_values = takeSample(thing_id, thing_id_params, property_list)
+                    trace.record("sample_read", t.perf_counter() - stage_start)
+                    if sample_values is None:
+                        continue
+                    samples[thing_id] += 1
+
+                    for param, value in sample_values.items():
+                        # for testing
+                        if param == "state":
+                            # NOTE: State is encoded as a string when reading from IoT Cloud api
+                            if value == "True":
+                                on_off_dict[thing_id][param]["on"] += 1
+                            else:
+                                on_off_dict[thing_id][param]["off"] += 1
+
+                        # if the param is a float track the value with largest magnitude
+                        if isinstance(value, float):
+                            if param not in max_values[thing_id]:
+                                max_values[thing_id][param] = value
+                            elif abs(value) > abs(max_values[thing_id][param]):
+                                max_values[thing_id][param] = value
+                        else:
+                            # if the param is a string count the number of times it appears
+                            value_str = str(value)
+                            if value_str not in value_counts[thing_id][param]:
+                                value_counts[thing_id][param][value_str] = 0
+                            value_counts[thing_id][param][value_str] += 1
+                n += 1
+            sampling["passes"] = n
+            sampling["samples"] = sum(samples.values())
+            sampling["errors"] = sum(errors.values())
+
+        def getValueToWrite(param: str, value_dict: dict) -> str:
+            """
+            This function determines the value to write to the database for a given parameter.
+            """
+            # if param is state, we check to see if any of the samples are True.
+            # If so, the state is written as "on". Otherwise it is written as "off". THIS WILL BE OVERWRITTEN BY N_ON AND N_OFF FOR TESTING
+            if param == "state":
+                if "True" in value_dict[param]:
+                    return "on"
+                else:
+                    return "off"
+            # if the param is a string, we take the most common occuring value
+            elif param in string_params:
+                return statistics.mode(value_dict[param].items())[0]
+            # For all other parameters, we take the most max magnitude
+            else:
+                if param not in value_dict:
+                    return None
+                return value_dict[param]
+
+        values_to_write = {}
+        for thing_id in thing_ids:
+            values_to_write[thing_id] = {}
+
+            # these are constants for each machine, irrelevant of sampling so just hard coded
+            values_to_write[thing_id]["timestamp"] = timestamp
+            values_to_write[thing_id]["thing_id"] = thing_id
+            stage_start = t.perf_counter()
+            values_to_write[thing_id]["machineName"] = (
+                db.collection("thing_ids").document(thing_id).get().to_dict()["name"]
+            )
+            trace.record("firestore_reads", t.perf_counter() - stage_start)
+
+            device_status = getDeviceStatus(thing_id, devices)
+            values_to_write[thing_id]["device_status"] = device_status
+
+            # for testing but we will write n_on and n_off for each time step to check thresholds.
+            values_to_write[thing_id]["n_on"] = on_off_dict[thing_id]["state"]["on"]
+            values_to_write[thing_id]["n_off"] = on_off_dict[thing_id]["state"]["off"]
+
+            # if state is on at least once, then it is set to on
+            if values_to_write[thing_id]["n_on"] > 0:
+                values_to_write[thing_id]["state"] = "on"
+            else:
+                values_to_write[thing_id]["state"] = "off"
+
+            # get value to write for each parameter
+            for param in sample_values:
+                if param not in string_params:
+                    values_to_write[thing_id][param] = getValueToWrite(
+                        param, max_values[thing_id]
+                    )
+                else:
+                    values_to_write[thing_id][param] = getValueToWrite(
+                        param, value_counts[thing_id]
+                    )
+
+            # make sure we didnt miss any
+            for param in max_values[thing_id]:
+                if (
+                    param not in values_to_write[thing_id]
+                    and max_values[thing_id][param] is not None
+                    and max_values[thing_id][param] != 0
+                ):
+                    values_to_write[thing_id][param] = max_values[thing_id][param]
+
+            for param in value_counts[thing_id]:
+                if (
+                    param not in values_to_write[thing_id]
+                    and value_counts[thing_id][param] is not None
+                    and value_counts[thing_id][param] != 0
+                ):
+                    values_to_write[thing_id][param] = value_counts[thing_id][param]
+
+            # overwrite if device is offline => automatically set to off
+            if device_status == "OFFLINE":
+                values_to_write[thing_id]["state"] = "off"
+
+        # write the most params for each machine
+        with trace.span("db_write") as span:
+            for thing_id in thing_ids:
+                write_state_to_db(
+                    values_to_write[thing_id], table_name="machine_states"
+                )
+            span["rows"] = len(thing_ids)
+        trace.finish(
+            f"Time step added to database in {t.time() - start} seconds",
+            devices=_device_counts(samples, errors),
+        )
+    except Exception as e:
+        print(f"Error in addTimeStep: {str(e)}")
+        trace.finish(
+            "addTimeStep failed",
+            error=str(e),
+            devices=_device_counts(samples, errors),
+        )
+        raise
@@ -1,10 +1,20 @@
 import pandas as pd
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import LabelEncoder
 import pickle
 import os
-import google.cloud.storage as storage
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import math
+import time
+from datetime import datetime
 import dotenv
+import numpy as np
+from consts import *
+from flat_forest import FlatForest
+from occupancy import DAYS_PER_WEEK, SLOTS_PER_DAY, OccupancyTable
+from registry import model_registry
 
 dotenv.load_dotenv()
 
@@ -18,13 +28,44 @@ def extract_features(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+def aggregate_slots(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Collapse raw samples (thing_id, state, timestamp) into 30 minute slots, the
+    same shape predictions.get_machine_state_slots_df reads from the database.
+    """
+    slots = pd.to_datetime(df["timestamp"]).dt.floor("30min")
+    things = df["thing_id"].astype("category")
+    on = (df["state"] == "on").to_numpy()
+
+    # assume state is on if on in any interval
+    df = (
+        pd.DataFrame({"thing_id": things, "slot": slots, "is_on": on})
+        .groupby(["thing_id", "slot"], sort=True, observed=True)["is_on"]
+        .max()
+        .reset_index()
+    )
+    return df
+
+
+def _json_float(value: float) -> float | None:
+    return None if math.isnan(value) else value
+
+
+def _isoformat(value: datetime | None) -> str | None:
+    return None if value is None else value.isoformat()
+
+
 class RandomForestModel:
-    def __init__(self, load_model: bool = True):
+    def __init__(self, load_model: bool = True, n_jobs: int = 1):
+        self._flat = None
+        self._record = None  # registry version whose pickled forest is not loaded
         # load model if it exists otherwise create new one
         if load_model:
             self.load(os.environ.get("MODEL_FILENAME"))
         else:
-            self.model = RandomForestClassifier(n_estimators=100, random_state=42)
+            self.model = RandomForestClassifier(
+                n_estimators=100, random_state=42, n_jobs=n_jobs
+            )
             self.label_encoder = LabelEncoder()
             self.thing_id_encoder = LabelEncoder()
 
@@ -32,145 +73,253 @@ class RandomForestModel:
         self.y_feature = "encoded_state"
         self.TEST_RATIO = 0.2
         self.n_datapoints = 0
+        self.n_test = 0
+        self.compaction_seconds = 0.0
 
     # split into test and train sets
     def _split_data(
         self, X: pd.DataFrame, y: pd.Series
     ) -> tuple[pd.DataFrame, pd.Series, pd.DataFrame, pd.Series]:
-        test_size = int(len(X) * self.TEST_RATIO)
+        # slice by train size, X[:-0] would be empty for a machine with few slots
+        train_size = len(X) - int(len(X) * self.TEST_RATIO)
 
-        X_train = X[:-test_size]
-        X_test = X[-test_size:]
-        y_train = y[:-test_size]
-        y_test = y[-test_size:]
+        X_train = X[:train_size]
+        X_test = X[train_size:]
+        y_train = y[:train_size]
+        y_test = y[train_size:]
 
         return X_train, X_test, y_train, y_test
 
-    # prepare data for training
-    def _prepare_data(self, df: pd.DataFrame) -> pd.DataFrame:
-        df = extract_features(df)
-
-        # 30 min intervals either :00 or :30
-        df["hour_slot"] = df["timestamp"].dt.floor("30min")
-        df["hour_slot"] = df["hour_slot"].apply(
-            lambda x: x.replace(minute=0) if x.minute < 30 else x.replace(minute=30)
-        )
-
-        # assume state is on if on in any interval
-        df = (
-            df.groupby(["thing_id", "hour_slot"])
-            .agg(
-                {
-                    "state": lambda x: "on" if "on" in x.values else "off",
-                    "hour": "first",
-                    "minute": "first",
-                    "day_of_week": "first",
-                }
-            )
-            .reset_index()
+    # encode a slot table (thing_id, slot, is_on) as model features
+    def _prepare_slots(self, df: pd.DataFrame) -> pd.DataFrame:
+        if "is_on" not in df.columns:
+            df = aggregate_slots(df)
+
+        # sorted by thing then slot; category codes follow the sorted categories, so
+        # they match what LabelEncoder would assign
+        # a subset of a slot table keeps every category, so drop the absent ones
+        things = df["thing_id"].astype("category").cat.remove_unused_categories()
+        things = things.cat.reorder_categories(sorted(things.cat.categories))
+        df = pd.DataFrame(
+            {"thing": things.cat.codes, "slot": df["slot"], "on": df["is_on"]}
+        ).sort_values(["thing", "slot"], kind="stable")
+
+        self.thing_id_encoder.fit(things.cat.categories.to_numpy())
+        present = np.unique(df["on"].to_numpy())
+        self.label_encoder.fit(np.array(["off", "on"])[present.astype(int)])
+
+        return pd.DataFrame(
+            {
+                "encoded_thing_id": df["thing"].to_numpy(),
+                "hour": df["slot"].dt.hour.to_numpy(),
+                "minute": df["slot"].dt.minute.to_numpy(),
+                "day_of_week": df["slot"].dt.dayofweek.to_numpy(),
+                "encoded_state": (
+                    df["on"].to_numpy().astype(np.int64)
+                    if len(present) == 2
+                    else np.zeros(len(df), dtype=np.int64)
+                ),
+            }
         )
 
-        # Rename columns for clarity
-        df = df.rename(columns={"hour_slot": "timestamp"})
-
-        # Encode categorical variables
-        df["encoded_state"] = self.label_encoder.fit_transform(df["state"])
-        df["encoded_thing_id"] = self.thing_id_encoder.fit_transform(df["thing_id"])
+    # prepare data for training
+    def _prepare_data(self, df: pd.DataFrame) -> tuple:
+        slots = self._prepare_slots(df)
 
         # break up X and y
-        X = df[self.X_features]
-        y = df[self.y_feature]
+        X = slots[self.X_features]
+        y = slots[self.y_feature]
 
         # split into test/train
         X_train, X_test, y_train, y_test = self._split_data(X, y)
         return X_train, X_test, y_train, y_test
 
-    # save model to GCP bucket
-    def save(self, file_name: str):
+    # publish the model and its occupancy table as a new version in the registry
+    def save(self, file_name: str, metadata: dict | None = None) -> dict:
         print("Serializing and saving model to GCP")
-        data_to_save = {
-            "model": self.model,
-            "label_encoder": self.label_encoder,
-            "thing_id_encoder": self.thing_id_encoder,
-        }
-
-        with open(file_name, "wb") as f:
-            pickle.dump(data_to_save, f)
-
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(os.environ.get("MODEL_BUCKET"))
-        blob = bucket.blob(file_name)
-        blob.upload_from_filename(file_name)
-        os.remove(file_name)
-        print(f"Model saved to {os.environ.get('MODEL_BUCKET')}")
+        return model_registry.publish(
+            file_name,
+            {
+                "model": self.to_bytes(),
+                "flat_forest": self.flat_forest().to_bytes(),
+                "occupancy_table": self.occupancy_table().to_bytes(),
+            },
+            {**self.metadata(), **(metadata or {})},
+            # getPeakHours reads the current version's table from a fixed blob
+            serve={"occupancy_table": OCCUPANCY_TABLE_FILENAME},
+        )
 
-    # load model from GCP bucket
+    # load the current version from the registry, from local disk when cached.
+    # predict only needs the flat forest, the pickled scikit-learn forest is
+    # fetched the first time something else needs it
     def load(self, file_name: str):
         print(f"Loading {file_name} from {os.environ.get('MODEL_BUCKET')}")
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(os.environ.get("MODEL_BUCKET"))
-        blob = bucket.blob(file_name)
-        blob.download_to_filename(file_name)
         try:
-            with open(file_name, "rb") as f:
-                save_data = pickle.load(f)
-                self.model = save_data["model"]
-                self.label_encoder = save_data["label_encoder"]
-                self.thing_id_encoder = save_data["thing_id_encoder"]
-                os.remove(file_name)
-                print(f"{file_name} loaded from {os.environ.get('MODEL_BUCKET')}")
+            record = model_registry.version(file_name)
+            if "flat_forest" in record["artifacts"]:
+                data = model_registry.fetch(record, "flat_forest")
+                self._flat = FlatForest.from_bytes(data)
+                self._record = record
+            else:
+                # published before the flat forest was stored
+                self._set_state(pickle.loads(model_registry.fetch(record)))
+            print(f"{file_name} version {record['version']} loaded")
         except Exception as e:
             print(
                 f"Error loading {file_name} from {os.environ.get('MODEL_BUCKET')}: {e}"
             )
 
-    # train the model
-    def train(self, df: pd.DataFrame) -> float:
-        print("Starting training")
+    # feature schema and size, stored with every published version
+    def metadata(self) -> dict:
+        self._load_estimator()
+        return {
+            "features": self.X_features,
+            "target": self.y_feature,
+            "thing_ids": [str(t) for t in self.thing_id_encoder.classes_],
+            "classes": [str(c) for c in self.label_encoder.classes_],
+            "datapoints": self.n_datapoints,
+            "nodes": self.flat_forest().n_nodes,
+            "min_samples_leaf": self.model.min_samples_leaf,
+        }
 
+    def _set_state(self, save_data: dict):
+        self.model = save_data["model"]
+        self.label_encoder = save_data["label_encoder"]
+        self.thing_id_encoder = save_data["thing_id_encoder"]
+        self._flat = None
+        self._record = None
+
+    # fetch the pickled forest of a version loaded through its flat forest
+    def _load_estimator(self):
+        if self._record is not None:
+            flat = self._flat
+            self._set_state(pickle.loads(model_registry.fetch(self._record)))
+            self._flat = flat
+
+    def to_bytes(self) -> bytes:
+        self._load_estimator()
+        return pickle.dumps(
+            {
+                "model": self.model,
+                "label_encoder": self.label_encoder,
+                "thing_id_encoder": self.thing_id_encoder,
+            }
+        )
+
+    # build a model from a pickled blob without going through a temp file
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "RandomForestModel":
+        model = cls(load_model=False)
+        model._set_state(pickle.loads(data))
+        return model
+
+    # fit the model and return its accuracy on the held out split, without saving
+    def fit(self, df: pd.DataFrame) -> float:
+        self._load_estimator()
         # prepare data for training
         X_train, X_test, y_train, y_test = self._prepare_data(df)
 
         # set number of datapoints trained on
         self.n_datapoints = len(X_train)
+        self.n_test = len(X_test)
+
+        # pick the tree size before the one fit on the whole training split
+        if COMPACT_MODEL:
+            self._compact(X_train, y_train)
 
         # train the model
         self.model.fit(X_train, y_train)
+        self._flat = None
 
-        # save the model
-        self.save(os.environ.get("MODEL_FILENAME"))
+        # evaluate the model on the held out split prepared above
+        if not len(X_test):
+            return float("nan")
+        return self.model.score(X_test, y_test)
 
-        # evaluate the model
+    # use smaller trees when a validation slice of the training split allows it,
+    # the test split stays unseen so the reported accuracy is not biased
+    def _compact(self, X_train: pd.DataFrame, y_train: pd.Series):
+        start = time.perf_counter()
+        X_fit, X_val, y_fit, y_val = self._split_data(X_train, y_train)
+        if not len(X_val) or not len(X_fit):
+            return
+
+        # the validation slice is whole machines at the end of the thing ordered
+        # rows, so the chosen size is still refit on the whole training split
+        acc = clone(self.model).fit(X_fit, y_fit).score(X_val, y_val)
+        # largest leaves first, they are the cheapest to fit, and stop at the first
+        # one that is accurate enough, usually after a single candidate
+        for leaf in sorted(COMPACT_MIN_SAMPLES_LEAF, reverse=True):
+            if leaf <= self.model.min_samples_leaf:
+                break
+            candidate = clone(self.model).set_params(min_samples_leaf=leaf)
+            candidate_acc = candidate.fit(X_fit, y_fit).score(X_val, y_val)
+            if candidate_acc >= acc - COMPACT_TOLERANCE:
+                print(f"Compacting to min_samples_leaf={leaf}: {candidate_acc}")
+                self.model = candidate
+                break
+        self.compaction_seconds = time.perf_counter() - start
+        print(f"Compaction took {self.compaction_seconds:.2f}s")
+
+    # the forest as flat node arrays, built once per fitted or loaded model
+    def flat_forest(self) -> FlatForest:
+        if self._flat is None:
+            self._flat = FlatForest.from_model(self)
+        return self._flat
 
-        acc = self.evaluate(df)
-        print(f"Training finished: {acc}")
+    # train the model
+    def train(self, df: pd.DataFrame, watermark: datetime | None = None) -> float:
+        print("Starting training")
+        acc = self.fit(df)
+
+        # save the model, with the probabilities getPeakHours serves from
+        self.save(
+            os.environ.get("MODEL_FILENAME"),
+            {"accuracy": _json_float(acc), "watermark": _isoformat(watermark)},
+        )
 
+        print(f"Training finished: {acc}")
         return acc
 
     # predict the state of a machine at a given time
     def predict(self, df: pd.DataFrame) -> pd.DataFrame:
-        df = df.copy()
-
-        # encode thing_id
-        if "thing_id" in df.columns:
-            df["encoded_thing_id"] = self.thing_id_encoder.transform(df["thing_id"])
-
-        # extract features for prediction
-        df = extract_features(df)
-
-        # get predictions and probabilities
-        predictions = self.model.predict(df[self.X_features])
-        probabilities = self.model.predict_proba(df[self.X_features])
-
-        # create result dataframe
-        result = df.copy()
-        result["predicted_state"] = self.label_encoder.inverse_transform(predictions)
-        result["probability_on"] = probabilities[:, 1]  # Probability of being 'on'
-
-        return result
+        # one pass over the flattened trees gives the states and probabilities
+        return self.flat_forest().predict(df)
+
+    # evaluate the model over every (thing, day of week, 30 min slot) input
+    def occupancy_table(self) -> OccupancyTable:
+        self._load_estimator()
+        thing_ids = self.thing_id_encoder.classes_
+        encoded, days, slots = np.meshgrid(
+            np.arange(len(thing_ids)),
+            np.arange(DAYS_PER_WEEK),
+            np.arange(SLOTS_PER_DAY),
+            indexing="ij",
+        )
+        grid = pd.DataFrame(
+            {
+                "encoded_thing_id": encoded.ravel(),
+                "hour": slots.ravel() // 2,
+                "minute": slots.ravel() % 2 * 30,
+                "day_of_week": days.ravel(),
+            }
+        )[self.X_features]
+
+        # column of predict_proba for "on" (absent if no sample was ever on)
+        probs = np.zeros(len(grid))
+        if "on" in self.label_encoder.classes_:
+            on = self.label_encoder.transform(["on"])[0]
+            if on in self.model.classes_:
+                column = list(self.model.classes_).index(on)
+                # thousands of rows, faster through scikit-learn than FlatForest
+                probs = self.model.predict_proba(grid)[:, column]
+
+        shape = (len(thing_ids), DAYS_PER_WEEK, SLOTS_PER_DAY)
+        return OccupancyTable(thing_ids, probs.reshape(shape).astype(np.float32))
 
     # get accuracy for trianing run
     def evaluate(self, df: pd.DataFrame) -> float:
+        self._load_estimator()
         # prepare data for evaluation
         X_train, X_test, y_train, y_test = self._prepare_data(df)
 
@@ -229,3 +378,98 @@ class RandomForestModel:
             .str.cat(["Z"] * len(timestamps))
             .tolist()
         )
+
+
+# registry name of the occupancy table trained with a partition
+def partition_model_name(partition: str) -> str:
+    return f"{PARTITION_MODEL_PREFIX}/{partition}"
+
+
+def _fit_group(group: str, slots: pd.DataFrame) -> tuple:
+    # runs in a worker process, only the occupancy table and scores come back
+    model = RandomForestModel(load_model=False)
+    acc = model.fit(slots)
+    return (
+        group,
+        acc,
+        model.n_datapoints,
+        model.n_test,
+        model.model.min_samples_leaf,
+        model.compaction_seconds,
+        model.occupancy_table(),
+    )
+
+
+def train_partitioned(
+    slots: pd.DataFrame,
+    groups: dict,
+    partition: str = MODEL_PARTITION,
+    workers: int = TRAINING_WORKERS,
+    watermark: datetime | None = None,
+) -> tuple[float, int, float]:
+    """
+    Train one model per group of machines in a process pool and publish the
+    occupancy table built from all of them to the registry, as the version
+    getPeakHours serves. Only the table is kept, the models themselves are not saved.
+
+    groups maps thing_id to group; machines missing from it get a group of their
+    own. Returns the accuracy over every held out split, the datapoints trained on
+    and the seconds spent choosing tree sizes, summed over the groups.
+    """
+    print(f"Starting {partition} training")
+    # group of every row, looked up once per distinct thing_id
+    thing_ids = slots["thing_id"].astype(str)
+    keys = thing_ids.map(
+        {
+            thing_id: str(groups.get(thing_id, thing_id))
+            for thing_id in thing_ids.unique()
+        }
+    )
+
+    # spawn so workers do not inherit gRPC and storage clients from this process.
+    # each worker imports pandas and scikit-learn, so start no more than there are
+    # groups to train
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=max(1, min(workers, keys.nunique())), mp_context=context
+    ) as pool:
+        futures = [
+            pool.submit(_fit_group, group, df)
+            for group, df in slots.groupby(keys, sort=True)
+        ]
+        results = [future.result() for future in futures]
+
+    tables, accuracies, leaves = [], {}, {}
+    correct = tested = datapoints = compaction_seconds = 0
+    for group, group_acc, n_datapoints, n_test, leaf, seconds, table in results:
+        tables.append(table)
+        accuracies[group] = _json_float(group_acc)
+        leaves[group] = leaf
+        datapoints += n_datapoints
+        compaction_seconds += seconds
+        if n_test:
+            correct += group_acc * n_test
+            tested += n_test
+    acc = correct / tested if tested else float("nan")
+
+    table = OccupancyTable(
+        [thing_id for table in tables for thing_id in table.thing_ids],
+        np.concatenate([table.probs for table in tables]),
+    )
+    # versioned like the global model, so pin and rollback change what is served
+    model_registry.publish(
+        partition_model_name(partition),
+        {"occupancy_table": table.to_bytes()},
+        {
+            "partition": partition,
+            "thing_ids": table.thing_ids,
+            "datapoints": datapoints,
+            "accuracy": _json_float(acc),
+            "group_accuracy": accuracies,
+            "group_min_samples_leaf": leaves,
+            "watermark": _isoformat(watermark),
+        },
+        serve={"occupancy_table": OCCUPANCY_TABLE_FILENAME},
+    )
+    print(f"Training finished: {len(results)} models, {acc}")
+    return acc, datapoints, compaction_seconds
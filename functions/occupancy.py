@@ -0,0 +1,291 @@
+import io
+import os
+from datetime import datetime, time, timedelta
+import numpy as np
+from blob_cache import BlobCache
+from clients import get_firestore
+from consts import *
+
+# the model predicts 30 minute slots, so every input is (thing, day of week, slot)
+SLOTS_PER_DAY = 48
+DAYS_PER_WEEK = 7
+
+
+def slot_index(timestamp: datetime) -> int:
+    return timestamp.hour * 2 + timestamp.minute // 30
+
+
+def floor_to_slot(timestamp: datetime) -> datetime:
+    return timestamp.replace(
+        minute=0 if timestamp.minute < 30 else 30, second=0, microsecond=0
+    )
+
+
+class OccupancyTable:
+    """
+    Probability that each machine is on for every (day of week, 30 minute slot),
+    evaluated from the trained model once at train time.
+
+    probs has shape (things, 7, 48), days Monday..Sunday like pandas dayofweek.
+    """
+
+    def __init__(self, thing_ids, probs: np.ndarray):
+        self.thing_ids = [str(thing_id) for thing_id in thing_ids]
+        self.probs = probs
+        self.index = {thing_id: i for i, thing_id in enumerate(self.thing_ids)}
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer, thing_ids=np.array(self.thing_ids), probs=self.probs
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "OccupancyTable":
+        with np.load(io.BytesIO(data)) as arrays:
+            return cls(arrays["thing_ids"].tolist(), arrays["probs"])
+
+    def probability(self, thing_id: str, timestamps: list) -> np.ndarray:
+        row = self.index[thing_id]
+        days = [timestamp.weekday() for timestamp in timestamps]
+        slots = [slot_index(timestamp) for timestamp in timestamps]
+        return self.probs[row, days, slots]
+
+    # predict the hours of the day that the machine is most or least likely to be on
+    def predict_hours(
+        self,
+        thing_id: str,
+        date: str,
+        start_time: str,
+        end_time: str,
+        peak: bool = True,
+        gym_open_time: str = "06:00:00",
+        gym_close_time: str = "18:30:00",
+    ) -> list:
+        timestamps = window_slots(
+            date, start_time, end_time, gym_open_time, gym_close_time
+        )
+        if not timestamps:
+            return []
+
+        probs = self.probability(thing_id, timestamps)
+        return top_slots(probs[None, :], timestamps, peak)[0]
+
+    # peak and off peak hours of many machines from one lookup over the stacked grid
+    def predict_hours_batch(
+        self,
+        thing_ids: list,
+        date: str,
+        start_time: str,
+        end_time: str,
+        gym_open_time: str = "06:00:00",
+        gym_close_time: str = "18:30:00",
+    ) -> list:
+        timestamps = window_slots(
+            date, start_time, end_time, gym_open_time, gym_close_time
+        )
+        known = [thing_id for thing_id in thing_ids if thing_id in self.index]
+        peak, off_peak = [[]] * len(known), [[]] * len(known)
+        if timestamps and known:
+            rows = np.array([self.index[thing_id] for thing_id in known])
+            days = np.array([timestamp.weekday() for timestamp in timestamps])
+            slots = np.array([slot_index(timestamp) for timestamp in timestamps])
+            # (machines, slots) probabilities
+            probs = self.probs[rows[:, None], days, slots]
+            peak = top_slots(probs, timestamps, True)
+            off_peak = top_slots(probs, timestamps, False)
+
+        hours = {
+            thing_id: {"peak": p, "off_peak": o}
+            for thing_id, p, o in zip(known, peak, off_peak)
+        }
+        # machines without a model yet get empty lists
+        return [
+            {"thing_id": thing_id, **hours.get(thing_id, {"peak": [], "off_peak": []})}
+            for thing_id in thing_ids
+        ]
+
+    # peak and off peak hours of many machines for each day of a date range
+    def forecast(
+        self,
+        thing_ids: list,
+        start_date: str,
+        days: int = 7,
+        count: int = 3,
+        gym_open_time: str = "06:00:00",
+        gym_close_time: str = "18:30:00",
+    ) -> list:
+        first = datetime.fromisoformat(start_date).replace(
+            hour=0, minute=0, second=0, microsecond=0, tzinfo=None
+        )
+        dates = [first + timedelta(days=day) for day in range(days)]
+        # only slots inside gym hours are built, the same ones on every day
+        slots = day_slots(gym_open_time, gym_close_time)
+        labels = np.array(
+            [
+                [format_slot(day + timedelta(minutes=30 * int(s))) for s in slots]
+                for day in dates
+            ],
+            dtype=object,
+        ).reshape(len(dates), len(slots))
+
+        known = [thing_id for thing_id in thing_ids if thing_id in self.index]
+        hours = {}
+        if known and len(slots):
+            rows = np.array([self.index[thing_id] for thing_id in known])
+            weekdays = np.array([day.weekday() for day in dates])
+            # (machines, days, slots) probabilities from one lookup
+            probs = self.probs[rows[:, None, None], weekdays[:, None], slots]
+            day_index = np.arange(len(dates))[:, None]
+            peak = labels[day_index, rank_slots(probs, True, count)]
+            off_peak = labels[day_index, rank_slots(probs, False, count)]
+            for i, thing_id in enumerate(known):
+                hours[thing_id] = [
+                    {
+                        "date": day.date().isoformat(),
+                        "peak": peak[i, d].tolist(),
+                        "off_peak": off_peak[i, d].tolist(),
+                    }
+                    for d, day in enumerate(dates)
+                ]
+
+        # machines without a model yet get no days
+        return [
+            {"thing_id": thing_id, "days": hours.get(thing_id, [])}
+            for thing_id in thing_ids
+        ]
+
+
+def window_slots(
+    date: str,
+    start_time: str,
+    end_time: str,
+    gym_open_time: str = "06:00:00",
+    gym_close_time: str = "18:30:00",
+) -> list:
+    """
+    Every 30 minute slot from start to end on date, inside the time window and gym
+    hours, in ascending order.
+    """
+    day = datetime.fromisoformat(date).date()
+    start = datetime.fromisoformat(start_time)
+    end = datetime.fromisoformat(end_time)
+    min_time, max_time = start.time(), end.time()
+    open_time = time.fromisoformat(gym_open_time)
+    close_time = time.fromisoformat(gym_close_time)
+
+    timestamps = []
+    timestamp = floor_to_slot(start)
+    while timestamp <= floor_to_slot(end):
+        if (
+            timestamp.date() == day
+            and min_time <= timestamp.time() <= max_time
+            and open_time <= timestamp.time() <= close_time
+        ):
+            timestamps.append(timestamp)
+        timestamp += timedelta(minutes=30)
+    return timestamps
+
+
+def rank_slots(probs: np.ndarray, peak: bool, count: int = 3) -> np.ndarray:
+    """
+    Indices along the last axis of probs of the count highest (peak) or lowest
+    probabilities. Among equal probabilities the latest slot comes first.
+    """
+    # latest first, then a stable sort on probability keeps that order for ties
+    latest_first = probs[..., ::-1]
+    order = np.argsort(-latest_first if peak else latest_first, axis=-1, kind="stable")
+    return probs.shape[-1] - 1 - order[..., :count]
+
+
+def format_slot(timestamp: datetime) -> str:
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def top_slots(probs: np.ndarray, timestamps: list, peak: bool, count: int = 3) -> list:
+    """
+    The count highest (peak) or lowest probability slots for each row of probs, as
+    formatted timestamps.
+    """
+    labels = [format_slot(timestamp) for timestamp in timestamps]
+    return [[labels[i] for i in row] for row in rank_slots(probs, peak, count)]
+
+
+def day_slots(gym_open_time: str, gym_close_time: str) -> np.ndarray:
+    """
+    Indices of the 30 minute slots of a day starting within gym hours.
+    """
+    open_time = time.fromisoformat(gym_open_time)
+    close_time = time.fromisoformat(gym_close_time)
+    opens = open_time.hour * 60 + open_time.minute + (open_time.second > 0)
+    closes = close_time.hour * 60 + close_time.minute
+    return np.arange(-(-opens // 30), closes // 30 + 1)
+
+
+occupancy_table_cache = BlobCache(
+    lambda: os.environ.get("MODEL_BUCKET"),
+    lambda: OCCUPANCY_TABLE_FILENAME,
+    OccupancyTable.from_bytes,
+)
+
+
+def get_thing_gyms() -> dict:
+    """
+    Map each thing_id to the gymId of its machine in Firestore.
+    """
+    gyms = {}
+    for doc in get_firestore().collection("machines").stream():
+        data = doc.to_dict()
+        if data.get("thingId") and data.get("gymId"):
+            gyms[str(data["thingId"])] = str(data["gymId"])
+    return gyms
+
+
+def peakHoursHelper(
+    thing_id: str,
+    date: str,
+    start_time: str,
+    end_time: str,
+    peak: bool = True,
+) -> list:
+    try:
+        # loaded once per instance and refreshed when retrainModel publishes a new
+        # table, missing until the first retrain
+        table = occupancy_table_cache.get()
+        return table.predict_hours(thing_id, date, start_time, end_time, peak)
+    except Exception as e:
+        print(f"No valid data for {thing_id} on {date} from {start_time} to {end_time}")
+        return []
+
+
+def fleetPeakHoursHelper(
+    thing_ids: list,
+    date: str,
+    start_time: str,
+    end_time: str,
+) -> list:
+    try:
+        table = occupancy_table_cache.get()
+    except Exception as e:
+        # no table before the first retrain, every machine gets empty lists
+        print(f"Error loading the occupancy table: {str(e)}")
+        return [
+            {"thing_id": thing_id, "peak": [], "off_peak": []} for thing_id in thing_ids
+        ]
+    return table.predict_hours_batch(thing_ids, date, start_time, end_time)
+
+
+def forecastPeakHoursHelper(
+    thing_ids: list,
+    start_date: str,
+    days: int = 7,
+    count: int = 3,
+) -> list:
+    try:
+        table = occupancy_table_cache.get()
+    except Exception as e:
+        # no table before the first retrain, every machine gets no days
+        print(f"Error loading the occupancy table: {str(e)}")
+        return [{"thing_id": thing_id, "days": []} for thing_id in thing_ids]
+    return table.forecast(thing_ids, start_date, days, count)
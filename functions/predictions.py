@@ -0,0 +1,209 @@
+import io
+import os
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from clients import get_storage_client
+from consts import *
+from database import init_read_db_connection
+
+# lower bound for a full read, before any sample
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# samples collapsed to 30 minute slots per thing in the database, on if any
+# sample in the slot was on (the reduction RandomForestModel trains on)
+TRAINING_SLOTS_QUERY = """
+    SELECT
+        thing_id,
+        date_bin(
+            interval '30 minutes', timestamp, TIMESTAMPTZ '2000-01-01 00:00:00+00'
+        ) AS slot,
+        bool_or(state = 'on') AS is_on
+    FROM machine_states
+    WHERE device_status = 'ONLINE' AND timestamp > :since AND timestamp <= :until
+    GROUP BY thing_id, slot
+"""
+
+TRAINING_WATERMARK_QUERY = """
+    SELECT max(timestamp), count(*) FROM machine_states
+    WHERE device_status = 'ONLINE' AND timestamp > :since
+"""
+
+
+def get_training_watermark(
+    since: datetime | None = None,
+) -> tuple[datetime | None, int]:
+    """
+    Timestamp of the newest online sample after since (None if there is none) and
+    the number of online samples after since.
+    """
+    try:
+        engine = init_read_db_connection()
+        with engine.connect() as conn:
+            until, n_rows = conn.execute(
+                text(TRAINING_WATERMARK_QUERY), {"since": since or EPOCH}
+            ).one()
+            return until, n_rows
+
+    except Exception as e:
+        print(f"Error reading training watermark: {e}")
+        raise
+
+
+def get_machine_state_slots_df(
+    since: datetime | None = None,
+    until: datetime | None = None,
+    chunk_size: int = TRAINING_CHUNK_SIZE,
+) -> pd.DataFrame:
+    """
+    Training data aggregated to (thing_id, slot, is_on) in SQL and streamed in
+    chunks, so memory grows with slots x devices instead of raw minute rows.
+    thing_id is categorical, slot a UTC datetime64 and is_on a bool.
+
+    Only samples with since < timestamp <= until are read (all of them by default).
+    """
+    try:
+        engine = init_read_db_connection()
+        things, slots, on = [], [], []
+
+        # server side cursor, rows arrive chunk_size at a time and only the
+        # compact columns are kept
+        with engine.connect().execution_options(stream_results=True) as conn:
+            result = conn.execute(
+                text(TRAINING_SLOTS_QUERY),
+                {
+                    "since": since or EPOCH,
+                    "until": until or datetime.now(timezone.utc),
+                },
+            )
+            for chunk in result.partitions(chunk_size):
+                chunk_things, chunk_slots, chunk_on = zip(*chunk)
+                things.append(pd.Categorical(chunk_things))
+                slots.append(
+                    pd.to_datetime(chunk_slots, utc=True).tz_localize(None).to_numpy()
+                )
+                on.append(np.array(chunk_on, dtype=bool))
+
+        return pd.DataFrame(
+            {
+                "thing_id": (
+                    pd.api.types.union_categoricals(things, sort_categories=True)
+                    if things
+                    else pd.Categorical([])
+                ),
+                "slot": pd.to_datetime(
+                    np.concatenate(slots) if slots else [], utc=True
+                ),
+                "is_on": np.concatenate(on) if on else np.array([], dtype=bool),
+            }
+        )
+
+    except Exception as e:
+        print(f"Error reading machine_states slots to DataFrame: {e}")
+        raise
+
+
+def merge_slots(slots: pd.DataFrame | None, new: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add newly aggregated slots to a slot table. A slot read in both (those in the
+    window read again before the watermark) is on if it was on in either.
+    """
+    if slots is None or slots.empty:
+        return new
+    if new.empty:
+        return slots
+
+    things = pd.api.types.union_categoricals(
+        [slots["thing_id"].array, new["thing_id"].array], sort_categories=True
+    )
+    df = pd.DataFrame(
+        {
+            "thing_id": things,
+            "slot": pd.concat([slots["slot"], new["slot"]], ignore_index=True),
+            "is_on": np.concatenate([slots["is_on"], new["is_on"]]),
+        }
+    )
+    return (
+        df.groupby(["thing_id", "slot"], sort=True, observed=True)["is_on"]
+        .max()
+        .reset_index()
+    )
+
+
+def training_rebuild_requested() -> bool:
+    """
+    Whether the TRAINING_REBUILD_FILENAME marker is in MODEL_BUCKET.
+    """
+    bucket = get_storage_client().bucket(os.environ.get("MODEL_BUCKET"))
+    return bucket.blob(TRAINING_REBUILD_FILENAME).exists()
+
+
+def clear_training_rebuild():
+    bucket = get_storage_client().bucket(os.environ.get("MODEL_BUCKET"))
+    bucket.blob(TRAINING_REBUILD_FILENAME).delete()
+    print(f"Full rebuild done, {TRAINING_REBUILD_FILENAME} removed")
+
+
+def load_training_slots() -> tuple[pd.DataFrame | None, datetime | None]:
+    """
+    The slot table and watermark saved by the last training run, (None, None) if
+    there is no saved table yet.
+    """
+    bucket = get_storage_client().bucket(os.environ.get("MODEL_BUCKET"))
+    blob = bucket.get_blob(TRAINING_SLOTS_FILENAME)
+    if blob is None:
+        return None, None
+
+    with np.load(io.BytesIO(blob.download_as_bytes())) as arrays:
+        slots = pd.DataFrame(
+            {
+                "thing_id": pd.Categorical.from_codes(
+                    arrays["codes"], arrays["thing_ids"].tolist()
+                ),
+                "slot": pd.to_datetime(arrays["slots"], unit="ns", utc=True),
+                "is_on": arrays["is_on"],
+            }
+        )
+        watermark = datetime.fromisoformat(str(arrays["watermark"]))
+    return slots, watermark
+
+
+def save_training_slots(slots: pd.DataFrame, watermark: datetime):
+    """
+    Save the slot table with the timestamp of the newest sample it includes.
+    """
+    things = slots["thing_id"].astype("category")
+    buffer = io.BytesIO()
+    np.savez_compressed(
+        buffer,
+        thing_ids=np.array(things.cat.categories, dtype=str),
+        codes=things.cat.codes.to_numpy(),
+        slots=pd.DatetimeIndex(slots["slot"]).as_unit("ns").asi8,
+        is_on=slots["is_on"].to_numpy(dtype=bool),
+        watermark=np.array(watermark.isoformat()),
+    )
+    bucket = get_storage_client().bucket(os.environ.get("MODEL_BUCKET"))
+    bucket.blob(TRAINING_SLOTS_FILENAME).upload_from_string(
+        buffer.getvalue(), content_type="application/octet-stream"
+    )
+    print(
+        f"Training slots up to {watermark} saved to {os.environ.get('MODEL_BUCKET')}"
+    )
+
+
+def generate_prediction_data(
+    thing_id: str, start_time: str, end_time: str
+) -> pd.DataFrame:
+    start_time = pd.to_datetime(pd.Timestamp(start_time))
+    end_time = pd.to_datetime(pd.Timestamp(end_time))
+
+    # round to nearest 30min interval
+    start_time = start_time.floor("30min")
+    end_time = end_time.floor("30min")
+    start_time = start_time.replace(minute=0 if start_time.minute < 30 else 30)
+    end_time = end_time.replace(minute=0 if end_time.minute < 30 else 30)
+
+    timestamps = pd.date_range(start=start_time, end=end_time, freq="30min")
+    return pd.DataFrame({"thing_id": thing_id, "timestamp": timestamps})
+
@@ -0,0 +1,236 @@
+import functools
+import json
+import os
+import random
+import sys
+import threading
+import time as t
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from consts import *
+from telemetry import log_json
+
+# frames kept per allocation traceback, more frames cost more memory and time
+TRACEMALLOC_FRAMES = 10
+# the async engine runs queries on this thread, so its stacks are sampled too
+ASYNC_LOOP_THREAD = "async-db-loop"
+
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    file_name = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({file_name}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Sampling CPU profiler. A background thread records the stacks of the profiled
+    thread (and the async loop thread) every interval and counts them as folded
+    stacks, the input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id: int, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000
+        self.counts = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="profile-sampler", daemon=True
+        )
+
+    def _thread_ids(self) -> dict:
+        ids = {self.thread_id: "request"}
+        for thread in threading.enumerate():
+            if thread.name == ASYNC_LOOP_THREAD:
+                ids[thread.ident] = ASYNC_LOOP_THREAD
+        return ids
+
+    def _run(self):
+        thread_ids = self._thread_ids()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, root in thread_ids.items():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(root)
+                self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.counts.items())
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        else:
+            tracemalloc.reset_peak()
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc():
+    """
+    Snapshot allocations still alive and the peak, then stop tracing if no other
+    profile is running.
+    """
+    global _tracemalloc_users
+
+    with _tracemalloc_lock:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+    snapshot = snapshot.filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__)]
+    )
+    return snapshot, current, peak
+
+
+def _memory_folded(snapshot) -> str:
+    """
+    Live allocations as folded stacks weighted by bytes.
+    """
+    lines = []
+    for stat in snapshot.statistics("traceback"):
+        stack = ";".join(
+            f"{os.path.basename(frame.filename)}:{frame.lineno}"
+            for frame in stat.traceback
+        )
+        lines.append(f"{stack} {stat.size}\n")
+    return "".join(lines)
+
+
+def _save(name: str, files: dict) -> list:
+    """
+    Write the profile files to PROFILE_DIR and upload them to PROFILE_BUCKET if set.
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    paths = []
+    for file_name, content in files.items():
+        path = os.path.join(PROFILE_DIR, file_name)
+        with open(path, "w") as f:
+            f.write(content)
+        paths.append(path)
+
+    if PROFILE_BUCKET:
+        from clients import get_storage_client
+
+        bucket = get_storage_client().bucket(PROFILE_BUCKET)
+        for path in paths:
+            blob = bucket.blob(f"profiles/{name}/{os.path.basename(path)}")
+            blob.upload_from_filename(path)
+        paths = [
+            f"gs://{PROFILE_BUCKET}/profiles/{name}/{os.path.basename(path)}"
+            for path in paths
+        ]
+    return paths
+
+
+@contextmanager
+def profile(name: str, reason: str, memory: bool = True):
+    """
+    Profile CPU (sampling) and, if memory is set, allocations (tracemalloc) for the
+    enclosed block and save <name>-<time>-<id>.cpu.folded, .mem.folded and .json.
+    """
+    started_at = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    profile_id = f"{started_at}-{uuid.uuid4().hex[:8]}"
+    sampler = StackSampler(threading.get_ident())
+    if memory:
+        _start_tracemalloc()
+    sampler.start()
+    start = t.perf_counter()
+    try:
+        yield
+    finally:
+        wall_ms = (t.perf_counter() - start) * 1000
+        sampler.stop()
+        snapshot, current, peak = _stop_tracemalloc() if memory else (None, None, None)
+        try:
+            top = snapshot.statistics("lineno")[:20] if memory else []
+            summary = {
+                "name": name,
+                "reason": reason,
+                "wall_ms": round(wall_ms, 2),
+                "cpu_samples": sampler.samples,
+                "interval_ms": PROFILE_INTERVAL_MS,
+                "memory_current_bytes": current,
+                "memory_peak_bytes": peak,
+                "top_allocations": [
+                    {
+                        "location": str(stat.traceback[0]),
+                        "bytes": stat.size,
+                        "count": stat.count,
+                    }
+                    for stat in top
+                ],
+            }
+            prefix = f"{name}-{profile_id}"
+            files = {
+                f"{prefix}.cpu.folded": sampler.folded(),
+                f"{prefix}.json": json.dumps(summary, indent=2),
+            }
+            if memory:
+                files[f"{prefix}.mem.folded"] = _memory_folded(snapshot)
+            paths = _save(name, files)
+            log_json(
+                f"profile saved for {name}",
+                profile=name,
+                reason=reason,
+                wall_ms=round(wall_ms, 2),
+                memory_peak_bytes=peak,
+                files=paths,
+            )
+        except Exception as e:
+            print(f"Error saving profile for {name}: {str(e)}")
+
+
+def request_profile_reason(req):
+    """
+    Why this request should be profiled, or None. A request is profiled when its
+    X-Profile header matches PROFILE_TOKEN, or at random for PROFILE_SAMPLE_RATE
+    of requests.
+    """
+    if PROFILE_TOKEN and req.headers.get("X-Profile") == PROFILE_TOKEN:
+        return "header"
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+def profile_job(job):
+    """
+    Profile every run of a scheduled job listed in PROFILE_JOBS.
+    """
+    name = job.__name__
+
+    @functools.wraps(job)
+    def wrapper(*args, **kwargs):
+        if name not in PROFILE_JOBS:
+            return job(*args, **kwargs)
+        with profile(name, "job"):
+            return job(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,536 @@
+from datetime import date, datetime, time, timedelta, timezone
+import base64
+import json
+from sqlalchemy import text
+from consts import *
+from database import init_read_db_connection
+
+# point lookups, shared with the async helpers in async_queries.py
+MOST_RECENT_VAR_QUERY = """
+    SELECT {variable}, timestamp
+    FROM {table_name}
+    WHERE thing_id = :machine
+    ORDER BY timestamp DESC
+    LIMIT 1
+"""
+LAST_LAT_QUERY = """
+    SELECT lat FROM machine_states WHERE thing_id = :thing_id AND lat IS NOT NULL and lat != 0 ORDER BY timestamp DESC LIMIT 1
+"""
+LAST_LONG_QUERY = """
+    SELECT long FROM machine_states WHERE thing_id = :thing_id AND long IS NOT NULL and long != 0 ORDER BY timestamp DESC LIMIT 1
+"""
+LAST_USED_TIME_QUERY = """
+    SELECT timestamp FROM machine_states WHERE thing_id = :thing_id AND state = 'on' ORDER BY timestamp DESC LIMIT 1
+"""
+LAST_USED_TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+
+def encode_cursor(timestamp: datetime, thing_id: str) -> str:
+    """
+    Encode the (timestamp, thing_id) key of the last returned row as an opaque cursor.
+    """
+    payload = json.dumps([timestamp.isoformat(), thing_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    """
+    Decode a cursor produced by encode_cursor. Raises ValueError if it is malformed.
+    """
+    try:
+        timestamp, thing_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(timestamp), str(thing_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def parse_limit(limit) -> int:
+    """
+    Clamp a requested page size to [1, TIMESERIES_MAX_LIMIT].
+    """
+    if limit is None or limit == "":
+        return TIMESERIES_DEFAULT_LIMIT
+    return max(1, min(int(limit), TIMESERIES_MAX_LIMIT))
+
+
+def parse_timestamp(value) -> datetime:
+    """
+    Parse an ISO 8601 time into an aware datetime so it is bound as a timestamptz
+    instead of being parsed by the database. Naive values are taken as UTC, like the
+    database session. None and datetimes pass through.
+    """
+    if value is None or value == "":
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def fetch_timeseries_from_db(
+    machine: str,
+    start_time: datetime | str,
+    variable: str,
+    table_name: str,
+    end_time: datetime | str = None,
+    limit: int = TIMESERIES_DEFAULT_LIMIT,
+    cursor: str = None,
+) -> tuple[list, str]:
+    """
+    Fetch one page of a timeseries ordered by timestamp, unique per thing_id (see
+    the machine_states unique index in schema.sql), so it alone is the page key.
+
+    Returns the rows and the cursor for the next page (None on the last page).
+    """
+    try:
+        engine = init_read_db_connection()
+        start_time, end_time = parse_timestamp(start_time), parse_timestamp(end_time)
+        params = {"machine": machine, "startTime": start_time, "limit": limit + 1}
+
+        # optional upper bound and keyset position
+        filters = ""
+        if end_time:
+            filters += " AND timestamp < :endTime"
+            params["endTime"] = end_time
+        if cursor:
+            # thing_id is fixed, so the (thing_id, timestamp) index seeks straight
+            # to the cursor instead of scanning the earlier pages again
+            params["cursorTs"], _ = decode_cursor(cursor)
+            filters += " AND timestamp > :cursorTs"
+
+        query = f"""
+        SELECT {variable}, timestamp, device_status, thing_id
+        FROM {table_name} 
+        WHERE thing_id = :machine AND timestamp >= :startTime{filters}
+        ORDER BY timestamp
+        LIMIT :limit
+        """
+        with engine.connect() as conn:
+            rows = conn.execute(text(query), params).fetchall()
+
+        # we fetched one extra row to know whether another page exists
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][1], rows[-1][3])
+
+        # Serialize into a list of dictionaries
+        return [
+            {variable: row[0], "timestamp": row[1].isoformat(), "status": row[2]}
+            for row in rows
+        ], next_cursor
+    except Exception as e:
+        print(f"Error fetching from db: {e}")
+        raise
+
+
+def fetchMostRecentVarFromDb(thing_id: str, variable: str, table_name: str) -> str:
+    try:
+        engine = init_read_db_connection()
+        query = MOST_RECENT_VAR_QUERY.format(variable=variable, table_name=table_name)
+        with engine.connect() as conn:
+            result = conn.execute(
+                text(query),
+                {"machine": thing_id},
+            )
+
+            # Serialize into a list of dictionaries
+            return [
+                {variable: row[0], "timestamp": row[1].isoformat()} for row in result
+            ]
+    except Exception as e:
+        print(f"Error fetching from db: {e}")
+        raise
+
+
+def getTimeseriesPage(
+    thing_id: str,
+    start_time: str,
+    variable: str,
+    table_name: str = "machine_states",
+    end_time: str = None,
+    limit: int = TIMESERIES_DEFAULT_LIMIT,
+    cursor: str = None,
+) -> tuple[str, str]:
+    try:
+        timeseries, next_cursor = fetch_timeseries_from_db(
+            thing_id, start_time, variable, table_name, end_time, limit, cursor
+        )
+        return json.dumps(timeseries), next_cursor
+    except Exception as e:
+        print(f"Error fetching timeseries: {str(e)}")
+        return json.dumps([]), None
+
+
+def getTimeseries(
+    thing_id: str,
+    start_time: str,
+    variable: str,
+    table_name: str = "machine_states",
+    end_time: str = None,
+    limit: int = TIMESERIES_DEFAULT_LIMIT,
+    cursor: str = None,
+) -> dict:
+    return getTimeseriesPage(
+        thing_id, start_time, variable, table_name, end_time, limit, cursor
+    )[0]
+
+
+def getLastLat(thing_id: str) -> float:
+    try:
+        engine = init_read_db_connection()
+        with engine.connect() as conn:
+            result = conn.execute(text(LAST_LAT_QUERY), {"thing_id": thing_id})
+            return result.scalar()
+    except Exception as e:
+        print(f"Error fetching last lat for {thing_id}: {e}")
+        return None
+
+
+def getLastLong(thing_id: str) -> float:
+    try:
+        engine = init_read_db_connection()
+        with engine.connect() as conn:
+            result = conn.execute(text(LAST_LONG_QUERY), {"thing_id": thing_id})
+            return result.scalar()
+    except Exception as e:
+        print(f"Error fetching last long for {thing_id}: {e}")
+        return None
+
+
+def getLastUsedTimeHelper(thing_id: str) -> str:
+    try:
+        engine = init_read_db_connection()
+        with engine.connect() as conn:
+            result = conn.execute(text(LAST_USED_TIME_QUERY), {"thing_id": thing_id})
+
+            # convert to human readable format
+            return result.scalar().strftime(LAST_USED_TIME_FORMAT)
+    except Exception as e:
+        print(f"Error fetching last used time for {thing_id}: {e}")
+        return None
+
+
+def getTotalUsageUtil(thing_id: str) -> int:
+    try:
+        engine = init_read_db_connection()
+        query = """
+            SELECT (COUNT(*)::float / 60)::float AS hours_used
+            FROM machine_states
+            WHERE thing_id = :thing_id
+            AND device_status = 'ONLINE'
+            AND state = 'on'
+        """
+        with engine.connect() as conn:
+            result = conn.execute(text(query), {"thing_id": thing_id})
+            value = result.scalar()
+
+            # Ensure we have a clean float value without % character
+            if value is not None:
+                if isinstance(value, str) and "%" in value:
+                    value = float(value.replace("%", ""))
+            return value
+    except Exception as e:
+        print(f"Error in getTotalUsage: {str(e)}")
+        return 0
+
+
+def getDailyUsageUtil(thing_id: str, date: str) -> int:
+    try:
+        engine = init_read_db_connection()
+
+        # Parse the date and calculate end date in Python
+        # bound the day with typed timestamps so the (thing_id, timestamp) index
+        # range scan needs no casts
+        start_date = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        end_date = start_date + timedelta(days=1)
+
+        # Use SQLAlchemy text() with named parameters
+        query = """
+            SELECT (COUNT(*)::float / 60)::float AS hours_used
+            FROM machine_states
+            WHERE thing_id = :thing_id
+            AND device_status = 'ONLINE'
+            AND state = 'on'
+            AND timestamp >= :start_date
+            AND timestamp < :end_date;
+        """
+
+        with engine.connect() as conn:
+            result = conn.execute(
+                text(query),
+                {"thing_id": thing_id, "start_date": start_date, "end_date": end_date},
+            )
+            value = result.scalar()
+
+            # Ensure we have a clean float value without % character
+            if value is not None:
+                if isinstance(value, str) and "%" in value:
+                    value = float(value.replace("%", ""))
+            return value
+    except Exception as e:
+        print(f"Error in getDailyUsage: {str(e)}")
+        return 0
+
+
+def getDailyUsageRangeUtil(thing_ids: list, start_date: date, end_date: date) -> dict:
+    """
+    Hours each thing id was in use on every day of [start_date, end_date].
+
+    Days are generated in SQL and left joined to one grouped count, so days
+    without usage are returned as 0.
+    """
+    # a repeated thing_id would repeat its rows in the cross join, keep the order
+    thing_ids = list(dict.fromkeys(thing_ids))
+    try:
+        engine = init_read_db_connection()
+        query = """
+            WITH days AS (
+                SELECT day::date AS day
+                FROM generate_series(
+                    CAST(:start_date AS date), CAST(:end_date AS date), interval '1 day'
+                ) AS day
+            ),
+            things AS (
+                SELECT unnest(CAST(:thing_ids AS text[])) AS thing_id
+            ),
+            usage AS (
+                SELECT
+                    thing_id,
+                    date_trunc('day', timestamp)::date AS day,
+                    (COUNT(*)::float / 60)::float AS hours_used
+                FROM machine_states
+                WHERE
+                    thing_id = ANY(:thing_ids)
+                    AND device_status = 'ONLINE'
+                    AND state = 'on'
+                    AND timestamp >= :start_time
+                    AND timestamp < :end_time
+                GROUP BY thing_id, day
+            )
+            SELECT things.thing_id, days.day, COALESCE(usage.hours_used, 0)
+            FROM things
+            CROSS JOIN days
+            LEFT JOIN usage
+                ON usage.thing_id = things.thing_id AND usage.day = days.day
+            ORDER BY things.thing_id, days.day;
+        """
+        params = {
+            "thing_ids": thing_ids,
+            "start_date": start_date,
+            "end_date": end_date,
+            "start_time": datetime.combine(start_date, time.min, timezone.utc),
+            "end_time": datetime.combine(
+                end_date + timedelta(days=1), time.min, timezone.utc
+            ),
+        }
+        daily_usage = {thing_id: [] for thing_id in thing_ids}
+        with engine.connect() as conn:
+            result = conn.execute(text(query), params)
+            for thing_id, day, hours_used in result:
+                daily_usage[thing_id].append(
+                    {"date": day.isoformat(), "hours": hours_used}
+                )
+        return daily_usage
+    except Exception as e:
+        print(f"Error in getDailyUsageRange: {str(e)}")
+        return {}
+
+
+def getDailyPercentagesUtil(thing_id: str) -> list:
+    try:
+        engine = init_read_db_connection()
+        query = """
+            SELECT
+                thing_id,
+                EXTRACT(ISODOW FROM timestamp)::int AS day_number,
+                TO_CHAR(timestamp, 'FMDay') AS day_name,
+                (COUNT(*)::float / (60 * 24) * 100) AS percent_in_use
+            FROM machine_states
+            WHERE
+                thing_id = :thing_id
+                AND state = 'on'
+                AND device_status = 'ONLINE'
+            GROUP BY
+                thing_id,
+                day_number,
+                day_name
+            ORDER BY
+                day_number;
+        """
+        with engine.connect() as conn:
+            result = conn.execute(text(query), {"thing_id": thing_id})
+            return [list(row) for row in result.fetchall()]
+    except Exception as e:
+        print(f"Error in getDailyPercentages: {str(e)}")
+        return []
+
+
+def getHourlyPercentagesUtil(thing_id: str) -> list:
+    try:
+        engine = init_read_db_connection()
+        query = """
+            SELECT
+                thing_id,
+                EXTRACT(HOUR FROM timestamp)::int AS hour_number,
+                (COUNT(*)::float / (60 * 60) * 100) AS percent_in_use
+            FROM machine_states
+            WHERE
+                thing_id = :thing_id
+                AND state = 'on'
+                AND device_status = 'ONLINE'
+            GROUP BY
+                thing_id,
+                hour_number
+            ORDER BY
+                hour_number;
+        """
+        with engine.connect() as conn:
+            result = conn.execute(text(query), {"thing_id": thing_id})
+            return [list(row) for row in result.fetchall()]
+    except Exception as e:
+        print(f"Error in getHourlyPercentages: {str(e)}")
+        return []
+
+
+def getUsageSessionsUtil(
+    thing_ids: list, start_time: datetime | str, end_time: datetime | str = None
+) -> list:
+    """
+    Find runs of consecutive "on" samples (gaps-and-islands) for each thing id.
+
+    A new island starts whenever the state changes or two samples are more than
+    SESSION_MAX_GAP_MINUTES apart. Only the "on" islands are returned.
+    """
+    try:
+        engine = init_read_db_connection()
+        start_time, end_time = parse_timestamp(start_time), parse_timestamp(end_time)
+        params = {
+            "thing_ids": list(thing_ids),
+            "start_time": start_time,
+            "max_gap": SESSION_MAX_GAP_MINUTES,
+        }
+        end_filter = ""
+        if end_time:
+            end_filter = "AND timestamp < :end_time"
+            params["end_time"] = end_time
+
+        query = f"""
+            WITH ordered AS (
+                SELECT
+                    thing_id,
+                    timestamp,
+                    state,
+                    LAG(state) OVER w AS prev_state,
+                    LAG(timestamp) OVER w AS prev_timestamp
+                FROM machine_states
+                WHERE
+                    thing_id = ANY(:thing_ids)
+                    AND device_status = 'ONLINE'
+                    AND timestamp >= :start_time
+                    {end_filter}
+                WINDOW w AS (PARTITION BY thing_id ORDER BY timestamp)
+            ),
+            islands AS (
+                SELECT
+                    thing_id,
+                    timestamp,
+                    state,
+                    SUM(
+                        CASE
+                            WHEN prev_state IS DISTINCT FROM state
+                                OR timestamp - prev_timestamp > make_interval(mins => :max_gap)
+                            THEN 1 ELSE 0
+                        END
+                    ) OVER (PARTITION BY thing_id ORDER BY timestamp) AS island
+                FROM ordered
+            ),
+            sessions AS (
+                SELECT
+                    thing_id,
+                    MIN(timestamp) AS session_start,
+                    MAX(timestamp) AS session_end
+                FROM islands
+                WHERE state = 'on'
+                GROUP BY thing_id, island
+            )
+            SELECT
+                thing_id,
+                session_start,
+                session_end,
+                (EXTRACT(EPOCH FROM session_end - session_start) / 60 + 1)::float
+                    AS duration_minutes,
+                (
+                    EXTRACT(
+                        EPOCH FROM session_start - LAG(session_end) OVER (
+                            PARTITION BY thing_id ORDER BY session_start
+                        )
+                    ) / 60
+                )::float AS gap_minutes
+            FROM sessions
+            ORDER BY thing_id, session_start;
+        """
+        with engine.connect() as conn:
+            result = conn.execute(text(query), params)
+            return [
+                {
+                    "thing_id": row[0],
+                    "start": row[1].isoformat(),
+                    "end": row[2].isoformat(),
+                    "duration_minutes": row[3],
+                    "gap_minutes": row[4],
+                }
+                for row in result
+            ]
+    except Exception as e:
+        print(f"Error in getUsageSessions: {str(e)}")
+        return []
+
+
+def getUsageHeatmapUtil(
+    thing_ids: list, start_time: datetime | str = None, end_time: datetime | str = None
+) -> dict:
+    """
+    Percent of online samples that were "on" for every (day of week, hour) bucket.
+
+    Returns a dense 7x24 matrix per thing id, rows Monday..Sunday and columns
+    hours 0..23. Buckets without data are 0.
+    """
+    try:
+        engine = init_read_db_connection()
+        start_time, end_time = parse_timestamp(start_time), parse_timestamp(end_time)
+        params = {"thing_ids": list(thing_ids)}
+        filters = ""
+        if start_time:
+            filters += " AND timestamp >= :start_time"
+            params["start_time"] = start_time
+        if end_time:
+            filters += " AND timestamp < :end_time"
+            params["end_time"] = end_time
+
+        query = f"""
+            SELECT
+                thing_id,
+                EXTRACT(ISODOW FROM timestamp)::int AS day_number,
+                EXTRACT(HOUR FROM timestamp)::int AS hour_number,
+                (COUNT(*) FILTER (WHERE state = 'on')::float / COUNT(*) * 100)
+                    AS percent_in_use
+            FROM machine_states
+            WHERE
+                thing_id = ANY(:thing_ids)
+                AND device_status = 'ONLINE'{filters}
+            GROUP BY
+                thing_id,
+                day_number,
+                hour_number;
+        """
+        heatmap = {thing_id: [[0.0] * 24 for _ in range(7)] for thing_id in thing_ids}
+        with engine.connect() as conn:
+            result = conn.execute(text(query), params)
+            for thing_id, day_number, hour_number, percent_in_use in result:
+                heatmap[thing_id][day_number - 1][hour_number] = percent_in_use
+        return heatmap
+    except Exception as e:
+        print(f"Error in getUsageHeatmap: {str(e)}")
+        return {}
@@ -0,0 +1,239 @@
+"""
+Versioned model artifacts in Cloud Storage with a local disk cache.
+
+Layout in MODEL_BUCKET, under MODEL_REGISTRY_PREFIX/<name>/:
+    blobs/<sha256>            artifact contents, stored once per distinct content
+    versions/<version>.json   metadata of every published version
+    current.json              the metadata of the version being served
+
+Pin or roll back a version from the functions directory:
+    python registry.py model.pkl                     # list versions
+    python registry.py model.pkl --pin <version>
+    python registry.py model.pkl --rollback
+    python registry.py partitioned/device --rollback   # MODEL_PARTITION=device
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime, timezone
+from clients import get_storage_client
+from consts import *
+
+
+class ModelRegistry:
+    def __init__(
+        self,
+        bucket_name=lambda: os.environ.get("MODEL_BUCKET"),
+        prefix: str = MODEL_REGISTRY_PREFIX,
+        cache_dir: str = MODEL_CACHE_DIR,
+        cache_max_bytes: int = MODEL_CACHE_MAX_MB * 1024 * 1024,
+    ):
+        # bucket name is a callable so the env var is read on first use
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+
+    def _bucket(self):
+        return get_storage_client().bucket(self.bucket_name())
+
+    def path(self, name: str, *parts: str) -> str:
+        return "/".join([self.prefix, name, *parts])
+
+    def current_path(self, name: str) -> str:
+        return self.path(name, "current.json")
+
+    def publish(
+        self,
+        name: str,
+        artifacts: dict,
+        metadata: dict | None = None,
+        serve: dict | None = None,
+        make_current: bool = True,
+    ) -> dict:
+        """
+        Store artifacts (artifact name -> bytes) as a new version of name.
+
+        serve maps artifact names to fixed blob names that are kept as copies of
+        the current version's artifact, for readers that do not go through the
+        registry (the occupancy table getPeakHours serves from).
+        """
+        bucket = self._bucket()
+        now = datetime.now(timezone.utc)
+
+        hashes = {}
+        for artifact, data in artifacts.items():
+            digest = hashlib.sha256(data).hexdigest()
+            blob = bucket.blob(self.path(name, "blobs", digest))
+            # content addressed, an unchanged artifact is not uploaded again
+            if not blob.exists():
+                blob.upload_from_string(data, content_type="application/octet-stream")
+            self._write_cache(digest, data)
+            hashes[artifact] = {"sha256": digest, "size": len(data)}
+
+        record = {
+            **(metadata or {}),
+            "name": name,
+            "version": now.strftime("%Y%m%dT%H%M%S%fZ"),
+            "created": now.isoformat(),
+            "artifacts": hashes,
+            "serve": serve or {},
+        }
+        blob = bucket.blob(self.path(name, "versions", f"{record['version']}.json"))
+        blob.upload_from_string(json.dumps(record), content_type="application/json")
+        print(f"Published {name} version {record['version']}")
+
+        if make_current:
+            self._make_current(bucket, record)
+        return record
+
+    def version(self, name: str, version: str | None = None) -> dict:
+        """
+        Metadata of a version, the current one by default.
+        """
+        path = (
+            self.current_path(name)
+            if version is None
+            else self.path(name, "versions", f"{version}.json")
+        )
+        blob = self._bucket().get_blob(path)
+        if blob is None:
+            raise FileNotFoundError(f"{path} not found")
+        return json.loads(blob.download_as_bytes())
+
+    def versions(self, name: str) -> list:
+        """
+        Metadata of every published version, oldest first.
+        """
+        blobs = self._bucket().list_blobs(prefix=self.path(name, "versions") + "/")
+        return [
+            json.loads(blob.download_as_bytes())
+            for blob in sorted(blobs, key=lambda blob: blob.name)
+        ]
+
+    def pin(self, name: str, version: str) -> dict:
+        """
+        Serve a published version. Only metadata and served copies change, the
+        artifacts are not downloaded.
+        """
+        bucket = self._bucket()
+        record = self.version(name, version)
+        self._make_current(bucket, record)
+        return record
+
+    def rollback(self, name: str) -> dict:
+        """
+        Serve the version published before the current one.
+        """
+        current = self.version(name)["version"]
+        older = [
+            record["version"]
+            for record in self.versions(name)
+            if record["version"] < current
+        ]
+        if not older:
+            raise ValueError(f"No version of {name} older than {current}")
+        return self.pin(name, older[-1])
+
+    def fetch(self, record: dict, artifact: str = "model") -> bytes:
+        """
+        Contents of an artifact of a version, from the local disk cache when present.
+        """
+        digest = record["artifacts"][artifact]["sha256"]
+        data = self._read_cache(digest)
+        if data is None:
+            blob = self._bucket().blob(self.path(record["name"], "blobs", digest))
+            data = blob.download_as_bytes()
+            if hashlib.sha256(data).hexdigest() != digest:
+                raise ValueError(f"{record['name']} {artifact} does not match {digest}")
+            self._write_cache(digest, data)
+        return data
+
+    def _make_current(self, bucket, record: dict):
+        for artifact, blob_name in record.get("serve", {}).items():
+            digest = record["artifacts"][artifact]["sha256"]
+            blob = bucket.blob(self.path(record["name"], "blobs", digest))
+            # server side copy, readers of blob_name see a new generation
+            bucket.copy_blob(blob, bucket, blob_name)
+        bucket.blob(self.current_path(record["name"])).upload_from_string(
+            json.dumps(record), content_type="application/json"
+        )
+        print(f"{record['name']} now serving version {record['version']}")
+
+    def _cache_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, digest)
+
+    def _read_cache(self, digest: str) -> bytes | None:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._cache_path(digest), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if hashlib.sha256(data).hexdigest() != digest:
+            return None
+        # mark as recently used for pruning
+        os.utime(self._cache_path(digest))
+        return data
+
+    def _write_cache(self, digest: str, data: bytes):
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # write then rename so a concurrent reader never sees a partial file
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._cache_path(digest))
+            self._prune()
+        except OSError as e:
+            print(f"Error writing {digest} to the model cache: {e}")
+
+    def _prune(self):
+        # drop the least recently used files once the cache is over its limit
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.cache_max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+
+model_registry = ModelRegistry()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("name", help="registry name, e.g. the MODEL_FILENAME")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--pin", metavar="VERSION")
+    group.add_argument("--rollback", action="store_true")
+    args = parser.parse_args()
+
+    if args.pin:
+        model_registry.pin(args.name, args.pin)
+    elif args.rollback:
+        model_registry.rollback(args.name)
+    else:
+        current = model_registry.version(args.name)["version"]
+        for record in model_registry.versions(args.name):
+            marker = "*" if record["version"] == current else " "
+            print(
+                f"{marker} {record['version']}  accuracy={record.get('accuracy')}  "
+                f"datapoints={record.get('datapoints')}  "
+                f"watermark={record.get('watermark')}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import functools
+import os
+import threading
+import time as t
+from consts import *
+from profiling import profile, request_profile_reason
+from telemetry import current_endpoint, log_json, reset_endpoint, set_endpoint
+
+# upper bounds (ms) of the latency histogram buckets, the last bucket is +inf
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# set REQUEST_LOGS=0 to keep the aggregates without logging every request
+REQUEST_LOGS_ENABLED = os.environ.get("REQUEST_LOGS", "1") != "0"
+
+_lock = threading.Lock()
+# endpoint -> aggregate dict
+_metrics = {}
+
+
+def _endpoint_metrics(endpoint: str) -> dict:
+    entry = _metrics.get(endpoint)
+    if entry is None:
+        entry = _metrics[endpoint] = {
+            "requests": 0,
+            "errors": 0,
+            "statuses": {},
+            "latency_buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+            "latency_total_ms": 0.0,
+            "latency_max_ms": 0.0,
+            "bytes_total": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+        }
+    return entry
+
+
+def record_cache(hit: bool, endpoint: str = None) -> None:
+    """
+    Count a cache lookup against the current endpoint.
+    """
+    with _lock:
+        entry = _endpoint_metrics(endpoint or current_endpoint())
+        if hit:
+            entry["cache_hits"] += 1
+        else:
+            entry["cache_misses"] += 1
+
+
+def _record_request(endpoint: str, status: int, latency_ms: float, size: int):
+    bucket = len(LATENCY_BUCKETS_MS)
+    for i, bound in enumerate(LATENCY_BUCKETS_MS):
+        if latency_ms <= bound:
+            bucket = i
+            break
+
+    with _lock:
+        entry = _endpoint_metrics(endpoint)
+        entry["requests"] += 1
+        if status >= 500:
+            entry["errors"] += 1
+        entry["statuses"][str(status)] = entry["statuses"].get(str(status), 0) + 1
+        entry["latency_buckets"][bucket] += 1
+        entry["latency_total_ms"] += latency_ms
+        entry["latency_max_ms"] = max(entry["latency_max_ms"], latency_ms)
+        entry["bytes_total"] += size
+
+
+def _ratio(total: float, count: int):
+    return round(total / count, 4) if count else None
+
+
+def snapshot(reset: bool = False) -> dict:
+    """
+    Per-endpoint request count, status counts, latency histogram, payload bytes
+    and cache hit ratio.
+    """
+    with _lock:
+        items = [
+            (endpoint, {**entry, "statuses": dict(entry["statuses"])})
+            for endpoint, entry in _metrics.items()
+        ]
+        for _, entry in items:
+            entry["latency_buckets"] = list(entry["latency_buckets"])
+        if reset:
+            _metrics.clear()
+
+    result = {}
+    for endpoint, entry in items:
+        requests = entry["requests"]
+        lookups = entry["cache_hits"] + entry["cache_misses"]
+        result[endpoint] = {
+            "requests": requests,
+            "errors": entry["errors"],
+            "statuses": entry["statuses"],
+            "latency_ms": {
+                "buckets": LATENCY_BUCKETS_MS + ["inf"],
+                "counts": entry["latency_buckets"],
+                "mean": _ratio(entry["latency_total_ms"], requests),
+                "max": round(entry["latency_max_ms"], 3),
+            },
+            "bytes_total": entry["bytes_total"],
+            "bytes_mean": _ratio(entry["bytes_total"], requests),
+            "cache_hit_ratio": _ratio(entry["cache_hits"], lookups),
+        }
+    return result
+
+
+def track_request(handler):
+    """
+    Wrap an https_fn.on_request handler to record its latency, status and payload
+    size. Each request is also logged as one JSON line so Cloud Logging can build
+    log-based distribution metrics from it. Requests picked by
+    request_profile_reason are profiled.
+    """
+    endpoint = handler.__name__
+
+    @functools.wraps(handler)
+    def wrapper(req):
+        token = set_endpoint(endpoint)
+        start = t.perf_counter()
+        status = 500
+        size = 0
+        try:
+            reason = request_profile_reason(req)
+            if reason is None:
+                response = handler(req)
+            else:
+                memory = reason == "header" or PROFILE_SAMPLED_MEMORY
+                with profile(endpoint, reason, memory=memory):
+                    response = handler(req)
+            status = response.status_code
+            size = response.calculate_content_length() or 0
+            return response
+        finally:
+            latency_ms = (t.perf_counter() - start) * 1000
+            reset_endpoint(token)
+            _record_request(endpoint, status, latency_ms, size)
+            if REQUEST_LOGS_ENABLED:
+                log_json(
+                    f"{endpoint} {status}",
+                    endpoint=endpoint,
+                    method=req.method,
+                    status=status,
+                    latency_ms=round(latency_ms, 2),
+                    bytes=size,
+                )
+
+    return wrapper
@@ -0,0 +1,47 @@
+-- Tables used by the functions. Only needed to stand up a local Postgres;
+-- the Cloud SQL instance already has them.
+
+CREATE TABLE IF NOT EXISTS machine_states (
+    thing_id TEXT NOT NULL,
+    state TEXT,
+    timestamp TIMESTAMPTZ NOT NULL,
+    analogoffset DOUBLE PRECISION,
+    alt DOUBLE PRECISION,
+    lat DOUBLE PRECISION,
+    long DOUBLE PRECISION,
+    rate DOUBLE PRECISION,
+    samplenumber INTEGER,
+    smoothedrmscurrent DOUBLE PRECISION,
+    smoothingfactor DOUBLE PRECISION,
+    threshold DOUBLE PRECISION,
+    type TEXT,
+    name TEXT,
+    runtime DOUBLE PRECISION,
+    machinename TEXT,
+    device_status TEXT,
+    n_on INTEGER,
+    n_off INTEGER,
+    rms DOUBLE PRECISION,
+    floor INTEGER
+);
+
+-- addTimeStep writes one row per device per tick, so (thing_id, timestamp) is
+-- unique. getStateTimeseries pages on timestamp and relies on it
+CREATE UNIQUE INDEX IF NOT EXISTS machine_states_thing_id_timestamp_key
+    ON machine_states (thing_id, timestamp);
+DROP INDEX IF EXISTS machine_states_thing_id_timestamp_idx;
+
+CREATE TABLE IF NOT EXISTS training_results (
+    timestamp TIMESTAMPTZ NOT NULL,
+    accuracy DOUBLE PRECISION,
+    datapoints INTEGER,
+    input_rows INTEGER,
+    duration_seconds DOUBLE PRECISION,
+    min_samples_leaf INTEGER,
+    compaction_seconds DOUBLE PRECISION
+);
+
+ALTER TABLE training_results ADD COLUMN IF NOT EXISTS input_rows INTEGER;
+ALTER TABLE training_results ADD COLUMN IF NOT EXISTS duration_seconds DOUBLE PRECISION;
+ALTER TABLE training_results ADD COLUMN IF NOT EXISTS min_samples_leaf INTEGER;
+ALTER TABLE training_results ADD COLUMN IF NOT EXISTS compaction_seconds DOUBLE PRECISION;
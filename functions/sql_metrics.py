@@ -0,0 +1,216 @@
+import hashlib
+import os
+import re
+import sys
+import threading
+import time as t
+from functools import lru_cache
+from sqlalchemy import event
+from consts import *
+from telemetry import current_endpoint, log_json
+
+# set SQL_METRICS=0 to leave engines uninstrumented
+SQL_METRICS_ENABLED = os.environ.get("SQL_METRICS", "1") != "0"
+
+_FUNCTIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+_THIS_FILE = os.path.abspath(__file__)
+
+_lock = threading.Lock()
+# (endpoint, helper, fingerprint) -> aggregate dict
+_aggregates = {}
+_last_flush = t.monotonic()
+
+_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_BIND = re.compile(r"%\(\w+\)s|%s|\$\d+|(?<!:):\w+")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+
+MAX_PARAM_LENGTH = 200
+
+
+@lru_cache(maxsize=512)
+def fingerprint(statement: str) -> tuple:
+    """
+    Normalize a statement so the same query with different values groups together.
+    Returns (short hash, normalized text).
+    """
+    normalized = _COMMENT.sub(" ", statement)
+    normalized = _STRING.sub("?", normalized)
+    normalized = _BIND.sub("?", normalized)
+    normalized = _NUMBER.sub("?", normalized)
+    normalized = _IN_LIST.sub("(?)", normalized)
+    normalized = _SPACE.sub(" ", normalized).strip()
+    digest = hashlib.sha1(normalized.encode()).hexdigest()[:12]
+    return digest, normalized
+
+
+def _calling_helper() -> str:
+    """
+    Name of the innermost function in this package that issued the statement,
+    e.g. getTotalUsageUtil.
+    """
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if (
+            filename.startswith(_FUNCTIONS_DIR)
+            and filename != _THIS_FILE
+            and "site-packages" not in filename
+        ):
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return "unknown"
+
+
+def _truncate_params(parameters):
+    if isinstance(parameters, dict):
+        return {key: _truncate_params(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_truncate_params(value) for value in parameters]
+    text_value = repr(parameters) if not isinstance(parameters, str) else parameters
+    if len(text_value) > MAX_PARAM_LENGTH:
+        return text_value[:MAX_PARAM_LENGTH] + "..."
+    return parameters
+
+
+def _explain(conn, statement: str, parameters):
+    """
+    EXPLAIN (no ANALYZE, so nothing runs twice) the statement on the same DBAPI
+    connection. Wrapped in a savepoint so a failure can't abort the transaction.
+    """
+    if not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+        return None
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute("SAVEPOINT sql_metrics_explain")
+        try:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+            plan = cursor.fetchone()[0]
+            cursor.execute("RELEASE SAVEPOINT sql_metrics_explain")
+            return plan
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT sql_metrics_explain")
+            return f"explain failed: {e}"
+    except Exception as e:
+        return f"explain failed: {e}"
+    finally:
+        cursor.close()
+
+
+def _record(endpoint, helper, digest, normalized, duration_ms, rows, wait_ms):
+    global _last_flush
+
+    key = (endpoint, helper, digest)
+    with _lock:
+        entry = _aggregates.get(key)
+        if entry is None:
+            entry = _aggregates[key] = {
+                "statement": normalized,
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "rows": 0,
+                "pool_wait_ms": 0.0,
+                "slow": 0,
+            }
+        entry["count"] += 1
+        entry["total_ms"] += duration_ms
+        entry["max_ms"] = max(entry["max_ms"], duration_ms)
+        entry["rows"] += max(rows, 0)
+        entry["pool_wait_ms"] += wait_ms
+        if duration_ms >= SLOW_QUERY_MS:
+            entry["slow"] += 1
+        flush = t.monotonic() - _last_flush >= SQL_METRICS_FLUSH_SECONDS
+        if flush:
+            _last_flush = t.monotonic()
+    if flush:
+        log_json("sql aggregates", sql_aggregates=snapshot())
+
+
+def snapshot(reset: bool = False) -> dict:
+    """
+    Per-endpoint aggregates: {endpoint: [{helper, fingerprint, count, ...}]},
+    most expensive (by total time) first.
+    """
+    with _lock:
+        items = [(key, dict(entry)) for key, entry in _aggregates.items()]
+        if reset:
+            _aggregates.clear()
+
+    result = {}
+    for (endpoint, helper, digest), entry in items:
+        entry["helper"] = helper
+        entry["fingerprint"] = digest
+        entry["mean_ms"] = round(entry["total_ms"] / entry["count"], 3)
+        entry["total_ms"] = round(entry["total_ms"], 3)
+        entry["max_ms"] = round(entry["max_ms"], 3)
+        entry["pool_wait_ms"] = round(entry["pool_wait_ms"], 3)
+        result.setdefault(endpoint, []).append(entry)
+    for entries in result.values():
+        entries.sort(key=lambda entry: entry["total_ms"], reverse=True)
+    return result
+
+
+def _instrument_pool(pool) -> None:
+    """
+    Time every checkout and stash the wait on the connection so the statements
+    run on it can report it.
+    """
+    checkout = pool.connect
+
+    def timed_checkout():
+        start = t.perf_counter()
+        connection = checkout()
+        connection.info["checkout_wait_ms"] = (t.perf_counter() - start) * 1000
+        connection.info["checkout_wait_reported"] = False
+        return connection
+
+    pool.connect = timed_checkout
+
+
+def instrument_engine(engine) -> None:
+    """
+    Record fingerprint, duration, rows and pool wait for every statement run on a
+    sync Engine (pass async_engine.sync_engine for the asyncpg engine).
+    """
+    if not SQL_METRICS_ENABLED or getattr(engine, "_sql_metrics", False):
+        return
+    engine._sql_metrics = True
+    _instrument_pool(engine.pool)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_start", []).append(t.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        duration_ms = (t.perf_counter() - conn.info["query_start"].pop()) * 1000
+        digest, normalized = fingerprint(statement)
+        endpoint = current_endpoint()
+        helper = _calling_helper()
+        rows = cursor.rowcount if cursor.rowcount is not None else -1
+
+        # only the first statement after a checkout carries its wait
+        wait_ms = 0.0
+        if not conn.info.get("checkout_wait_reported", True):
+            wait_ms = conn.info.get("checkout_wait_ms", 0.0)
+            conn.info["checkout_wait_reported"] = True
+
+        _record(endpoint, helper, digest, normalized, duration_ms, rows, wait_ms)
+
+        if duration_ms >= SLOW_QUERY_MS:
+            log_json(
+                "slow query",
+                severity="WARNING",
+                endpoint=endpoint,
+                helper=helper,
+                fingerprint=digest,
+                statement=normalized,
+                parameters=_truncate_params(parameters),
+                duration_ms=round(duration_ms, 2),
+                rows=rows,
+                pool_wait_ms=round(wait_ms, 2),
+                plan=_explain(conn, statement, parameters),
+            )
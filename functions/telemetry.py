@@ -0,0 +1,133 @@
+import contextvars
+import json
+import os
+import time as t
+import uuid
+from contextlib import contextmanager
+
+
+# set TELEMETRY_OTEL=1 to also mirror spans to OpenTelemetry (needs an SDK/exporter
+# configured in the runtime, otherwise the API is a no-op)
+OTEL_ENABLED = os.environ.get("TELEMETRY_OTEL") == "1"
+
+# each deployed function runs in its own instance, so the target name is the
+# endpoint unless a caller sets one explicitly (request wrapper, benchmarks)
+_endpoint = contextvars.ContextVar("endpoint", default=None)
+_default_endpoint = (
+    os.environ.get("FUNCTION_TARGET") or os.environ.get("K_SERVICE") or "unknown"
+)
+
+
+def set_endpoint(name: str):
+    """
+    Attribute work done in the current context to an endpoint.
+    Returns a token for reset_endpoint.
+    """
+    return _endpoint.set(name)
+
+
+def reset_endpoint(token) -> None:
+    _endpoint.reset(token)
+
+
+def current_endpoint() -> str:
+    return _endpoint.get() or _default_endpoint
+
+
+def log_json(message: str, severity: str = "INFO", **fields) -> None:
+    """
+    Print a single structured log line. Cloud Logging parses JSON written to stdout
+    into jsonPayload, so these fields can be used directly in log-based metrics.
+    """
+    entry = {"severity": severity, "message": message, **fields}
+    print(json.dumps(entry, default=str), flush=True)
+
+
+class Trace:
+    """
+    Timing spans for one run of a pipeline (e.g. one addTimeStep tick).
+
+    Each span logs its own JSON line as it closes. Stage durations are also
+    accumulated so finish() can log a single summary line with the full breakdown.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.start = t.perf_counter()
+        self.stages = {}
+        self._tracer = None
+        self._root = None
+        if OTEL_ENABLED:
+            from opentelemetry import trace
+
+            self._tracer = trace.get_tracer("gymhawk")
+            self._root = self._tracer.start_span(name)
+
+    def record(self, stage: str, seconds: float) -> None:
+        """
+        Add time to a stage without logging, for work repeated inside a loop.
+        """
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def span(self, stage: str, **attributes):
+        """
+        Time a block of work. The yielded dict can be filled with extra attributes
+        (counts, sizes) that are logged alongside the duration.
+        """
+        otel_span = None
+        if self._tracer is not None:
+            from opentelemetry import trace
+
+            context = trace.set_span_in_context(self._root)
+            otel_span = self._tracer.start_span(stage, context=context)
+
+        span_start = t.perf_counter()
+        error = None
+        try:
+            yield attributes
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            duration = t.perf_counter() - span_start
+            self.record(stage, duration)
+            fields = dict(attributes)
+            if error is not None:
+                fields["error"] = error
+            log_json(
+                f"{self.name} {stage}",
+                severity="ERROR" if error is not None else "INFO",
+                trace=self.name,
+                trace_id=self.trace_id,
+                stage=stage,
+                duration_ms=round(duration * 1000, 2),
+                **fields,
+            )
+            if otel_span is not None:
+                for key, value in fields.items():
+                    if isinstance(value, (str, bool, int, float)):
+                        otel_span.set_attribute(key, value)
+                otel_span.end()
+
+    def finish(self, message: str, error: str = None, **fields) -> None:
+        """
+        Log the summary line for the run and close the root span.
+        """
+        total = t.perf_counter() - self.start
+        stages_ms = {stage: round(s * 1000, 2) for stage, s in self.stages.items()}
+        if error is not None:
+            fields["error"] = error
+        log_json(
+            message,
+            severity="ERROR" if error is not None else "INFO",
+            trace=self.name,
+            trace_id=self.trace_id,
+            duration_ms=round(total * 1000, 2),
+            stages_ms=stages_ms,
+            **fields,
+        )
+        if self._root is not None:
+            self._root.set_attribute("duration_ms", round(total * 1000, 2))
+            self._root.end()
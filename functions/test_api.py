@@ -1,19 +1,26 @@
 import pytest
 import json
 import pandas as pd
-from main import (
+from datetime import date
+from queries import (
     getTimeseries,
+    getTimeseriesPage,
     fetchMostRecentVarFromDb,
-    peakHoursHelper,
     getLastLat,
     getLastLong,
     getLastUsedTimeHelper,
-    addTimeStepUtil,
     getTotalUsageUtil,
     getDailyUsageUtil,
     getDailyPercentagesUtil,
     getHourlyPercentagesUtil,
+    getUsageSessionsUtil,
+    getUsageHeatmapUtil,
+    getDailyUsageRangeUtil,
 )
+from occupancy import fleetPeakHoursHelper, forecastPeakHoursHelper, peakHoursHelper
+from async_database import run_async
+from async_queries import getMachineSnapshotsAsync
+from ingest import addTimeStepUtil
 
 
 def time_checker(timestamp1, timestamp2):
@@ -127,6 +134,55 @@ def test_d1_blue_out_of_range():
         assert False, f"d1BlueTestGetStateTimeseries | Error: {e}"
 
 
+@pytest.mark.d1_green
+def test_d1_green_timeseries_pagination():
+    thing_id = "6ad4d9f7-8444-4595-bf0b-5fb62c36430c"
+    start_time = "2025-04-22T01:35:02.007Z"
+    variable = "state"
+    try:
+        body, cursor = getTimeseriesPage(thing_id, start_time, variable, limit=10)
+        first_page = json.loads(body)
+        assert len(first_page) == 10, (
+            f"d1GreenTestTimeseriesPagination | Page is not 10 rows: {first_page}"
+        )
+        assert cursor is not None, (
+            f"d1GreenTestTimeseriesPagination | Missing next cursor: {cursor}"
+        )
+
+        body, _ = getTimeseriesPage(
+            thing_id, start_time, variable, limit=10, cursor=cursor
+        )
+        second_page = json.loads(body)
+        assert len(second_page) > 0, (
+            f"d1GreenTestTimeseriesPagination | Second page is empty: {second_page}"
+        )
+        assert time_checker(second_page[0]["timestamp"], first_page[-1]["timestamp"]), (
+            f"d1GreenTestTimeseriesPagination | Pages overlap: {first_page[-1]} {second_page[0]}"
+        )
+    except Exception as e:
+        print(f"d1GreenTestTimeseriesPagination | Error: {e}")
+        assert False, f"d1GreenTestTimeseriesPagination | Error: {e}"
+
+
+@pytest.mark.d1_green
+def test_d1_green_timeseries_end_time():
+    thing_id = "6ad4d9f7-8444-4595-bf0b-5fb62c36430c"
+    start_time = "2025-04-22T01:35:02.007Z"
+    end_time = "2025-04-23T00:00:00.000Z"
+    variable = "state"
+    try:
+        timeseries = json.loads(
+            getTimeseries(thing_id, start_time, variable, end_time=end_time)
+        )
+        for point in timeseries:
+            assert not time_checker(point["timestamp"], end_time), (
+                f"d1GreenTestTimeseriesEndTime | Response is not before end time: {point}"
+            )
+    except Exception as e:
+        print(f"d1GreenTestTimeseriesEndTime | Error: {e}")
+        assert False, f"d1GreenTestTimeseriesEndTime | Error: {e}"
+
+
 @pytest.mark.d1_blue
 def test_d1_blue_get_device_state():
     thing_id = "0a73bf83-27de-4d93-b2a0-f23cbe2ba2a8"
@@ -554,3 +610,207 @@ def test_unknown_get_hourly_percentages():
     assert hourly_percentages == [], (
         f"UnknownTestGetHourlyPercentages | Response is not empty: {hourly_percentages}"
     )
+
+
+@pytest.mark.d1_green
+def test_d1_green_get_usage_sessions():
+    thing_id = "6ad4d9f7-8444-4595-bf0b-5fb62c36430c"
+    start_time = "2025-04-22T00:00:00.000Z"
+    end_time = "2025-04-29T00:00:00.000Z"
+    sessions = getUsageSessionsUtil([thing_id], start_time, end_time)
+    assert sessions is not None, (
+        f"d1GreenTestGetUsageSessions | Response is None: {sessions}"
+    )
+
+    for session in sessions:
+        assert session["thing_id"] == thing_id, (
+            f"d1GreenTestGetUsageSessions | Wrong thing_id: {session}"
+        )
+        assert time_checker(session["end"], session["start"]), (
+            f"d1GreenTestGetUsageSessions | Session ends before it starts: {session}"
+        )
+        assert session["duration_minutes"] >= 1, (
+            f"d1GreenTestGetUsageSessions | Session is shorter than a sample: {session}"
+        )
+        assert time_checker(session["start"], start_time), (
+            f"d1GreenTestGetUsageSessions | Session is not after start time: {session}"
+        )
+
+
+@pytest.mark.unknown
+def test_unknown_get_usage_sessions():
+    thing_id = "unknown"
+    start_time = "2025-04-22T00:00:00.000Z"
+    sessions = getUsageSessionsUtil([thing_id], start_time)
+    assert sessions == [], (
+        f"UnknownTestGetUsageSessions | Response is not empty: {sessions}"
+    )
+
+
+@pytest.mark.d1_blue
+def test_d1_blue_get_usage_heatmap():
+    thing_id = "0a73bf83-27de-4d93-b2a0-f23cbe2ba2a8"
+    heatmap = getUsageHeatmapUtil([thing_id])
+    assert thing_id in heatmap, (
+        f"d1BlueTestGetUsageHeatmap | Missing thing_id: {heatmap}"
+    )
+    assert len(heatmap[thing_id]) == 7, (
+        f"d1BlueTestGetUsageHeatmap | Response is not 7 days: {heatmap}"
+    )
+    for day in heatmap[thing_id]:
+        assert len(day) == 24, (
+            f"d1BlueTestGetUsageHeatmap | Day is not 24 hours: {day}"
+        )
+        assert all(0 <= percent <= 100 for percent in day), (
+            f"d1BlueTestGetUsageHeatmap | Percent out of range: {day}"
+        )
+
+
+@pytest.mark.unknown
+def test_unknown_get_usage_heatmap():
+    thing_id = "unknown"
+    heatmap = getUsageHeatmapUtil([thing_id])
+    assert heatmap == {thing_id: [[0.0] * 24 for _ in range(7)]}, (
+        f"UnknownTestGetUsageHeatmap | Response is not all zero: {heatmap}"
+    )
+
+
+@pytest.mark.d1_green
+def test_d1_green_get_daily_usage_range():
+    thing_id = "6ad4d9f7-8444-4595-bf0b-5fb62c36430c"
+    start_date = date(2025, 4, 22)
+    end_date = date(2025, 4, 28)
+    daily_usage = getDailyUsageRangeUtil([thing_id], start_date, end_date)
+    assert len(daily_usage.get(thing_id, [])) == 7, (
+        f"d1GreenTestGetDailyUsageRange | Response is not 7 days: {daily_usage}"
+    )
+    assert daily_usage[thing_id][0]["date"] == "2025-04-22", (
+        f"d1GreenTestGetDailyUsageRange | Wrong first day: {daily_usage}"
+    )
+
+    # the range must agree with the single day endpoint
+    single_day = getDailyUsageUtil(thing_id, "2025-04-22") or 0
+    assert abs(daily_usage[thing_id][0]["hours"] - single_day) < 1e-6, (
+        f"d1GreenTestGetDailyUsageRange | Does not match daily usage: {single_day}"
+    )
+
+
+@pytest.mark.d1_green
+def test_d1_green_get_daily_usage_range_repeated_thing_id():
+    thing_id = "6ad4d9f7-8444-4595-bf0b-5fb62c36430c"
+    start_date = date(2025, 4, 22)
+    end_date = date(2025, 4, 28)
+    daily_usage = getDailyUsageRangeUtil([thing_id, thing_id], start_date, end_date)
+    assert daily_usage == getDailyUsageRangeUtil([thing_id], start_date, end_date), (
+        f"d1GreenTestGetDailyUsageRangeRepeated | Days are repeated: {daily_usage}"
+    )
+
+
+@pytest.mark.unknown
+def test_unknown_get_daily_usage_range():
+    thing_id = "unknown"
+    daily_usage = getDailyUsageRangeUtil(
+        [thing_id], date(2025, 4, 22), date(2025, 4, 23)
+    )
+    assert [day["hours"] for day in daily_usage.get(thing_id, [])] == [0, 0], (
+        f"UnknownTestGetDailyUsageRange | Response is not zero filled: {daily_usage}"
+    )
+
+
+@pytest.mark.d1_green
+def test_d1_green_get_machine_snapshot():
+    thing_id = "6ad4d9f7-8444-4595-bf0b-5fb62c36430c"
+    snapshots = run_async(getMachineSnapshotsAsync([thing_id]))
+    assert len(snapshots) == 1, (
+        f"d1GreenTestGetMachineSnapshot | Response is not 1 machine: {snapshots}"
+    )
+
+    # the async path must agree with the sync helpers
+    snapshot = snapshots[0]
+    assert snapshot["lat"] == getLastLat(thing_id), (
+        f"d1GreenTestGetMachineSnapshot | Lat does not match: {snapshot}"
+    )
+    assert snapshot["long"] == getLastLong(thing_id), (
+        f"d1GreenTestGetMachineSnapshot | Long does not match: {snapshot}"
+    )
+    assert snapshot["state"] is not None, (
+        f"d1GreenTestGetMachineSnapshot | State is None: {snapshot}"
+    )
+
+
+@pytest.mark.unknown
+def test_unknown_get_machine_snapshot():
+    thing_id = "unknown"
+    snapshots = run_async(getMachineSnapshotsAsync([thing_id]))
+    assert snapshots[0]["state"] is None and snapshots[0]["lat"] is None, (
+        f"UnknownTestGetMachineSnapshot | Response is not empty: {snapshots}"
+    )
+
+
+@pytest.mark.d1_green
+def test_d1_green_get_fleet_peak_hours():
+    thing_ids = [
+        "6ad4d9f7-8444-4595-bf0b-5fb62c36430c",
+        "c7996422-9462-4fa7-8d02-bfe8c7aba7e4",
+    ]
+    date = "2025-04-22"
+    start_time = "2025-04-22T06:00:00.000Z"
+    end_time = "2025-04-22T19:00:00.000Z"
+    hours = fleetPeakHoursHelper(thing_ids, date, start_time, end_time)
+    assert [row["thing_id"] for row in hours] == thing_ids, (
+        f"d1GreenTestGetFleetPeakHours | Machines do not match: {hours}"
+    )
+
+    # the batch must agree with one getPeakHours call per machine
+    for row in hours:
+        for peak, key in [(True, "peak"), (False, "off_peak")]:
+            single = peakHoursHelper(
+                row["thing_id"], date, start_time, end_time, peak=peak
+            )
+            assert row[key] == single, (
+                f"d1GreenTestGetFleetPeakHours | {key} does not match: {row}"
+            )
+
+
+@pytest.mark.unknown
+def test_unknown_get_fleet_peak_hours():
+    hours = fleetPeakHoursHelper(
+        ["unknown"],
+        "2025-04-22",
+        "2025-04-22T06:00:00.000Z",
+        "2025-04-22T19:00:00.000Z",
+    )
+    assert hours == [{"thing_id": "unknown", "peak": [], "off_peak": []}], (
+        f"UnknownTestGetFleetPeakHours | Response is not empty: {hours}"
+    )
+
+
+@pytest.mark.d1_green
+def test_d1_green_get_peak_hours_forecast():
+    thing_id = "6ad4d9f7-8444-4595-bf0b-5fb62c36430c"
+    forecast = forecastPeakHoursHelper([thing_id], "2025-04-21", days=7)
+    days = forecast[0]["days"]
+    assert len(days) == 7, (
+        f"d1GreenTestGetPeakHoursForecast | Response is not 7 days: {forecast}"
+    )
+
+    # each day must agree with the single day batch over the gym hours
+    for day in days:
+        date = day["date"]
+        hours = fleetPeakHoursHelper(
+            [thing_id], date, f"{date}T00:00:00.000Z", f"{date}T23:59:00.000Z"
+        )[0]
+        assert day["peak"] == hours["peak"], (
+            f"d1GreenTestGetPeakHoursForecast | Peak does not match: {day}"
+        )
+        assert day["off_peak"] == hours["off_peak"], (
+            f"d1GreenTestGetPeakHoursForecast | Off peak does not match: {day}"
+        )
+
+
+@pytest.mark.unknown
+def test_unknown_get_peak_hours_forecast():
+    forecast = forecastPeakHoursHelper(["unknown"], "2025-04-21", days=7)
+    assert forecast == [{"thing_id": "unknown", "days": []}], (
+        f"UnknownTestGetPeakHoursForecast | Response is not empty: {forecast}"
+    )
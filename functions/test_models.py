@@ -0,0 +1,283 @@
+import numpy as np
+import pandas as pd
+import model as model_module
+import registry
+from flat_forest import FlatForest
+from model import RandomForestModel
+from occupancy import OccupancyTable
+from predictions import generate_prediction_data, merge_slots
+from registry import ModelRegistry
+
+# these tests need no database or Cloud Storage
+
+
+def make_table(n_things: int = 5, seed: int = 42) -> OccupancyTable:
+    rng = np.random.default_rng(seed)
+    # rounded so equal probabilities, and the tie order, are exercised too
+    probs = rng.random((n_things, 7, 48)).round(1).astype(np.float32)
+    return OccupancyTable([f"device-{i}" for i in range(n_things)], probs)
+
+
+def test_occupancy_table_roundtrip():
+    table = make_table()
+    loaded = OccupancyTable.from_bytes(table.to_bytes())
+    assert loaded.thing_ids == table.thing_ids, (
+        f"OccupancyTableRoundtrip | Thing ids differ: {loaded.thing_ids}"
+    )
+    assert np.array_equal(loaded.probs, table.probs), (
+        "OccupancyTableRoundtrip | Probabilities differ"
+    )
+
+
+def test_predict_hours_batch_matches_predict_hours():
+    table = make_table()
+    thing_ids = table.thing_ids + ["unknown"]
+    date = "2025-04-22"
+    start_time, end_time = "2025-04-22T05:00:00", "2025-04-22T21:00:00"
+
+    batch = table.predict_hours_batch(thing_ids, date, start_time, end_time)
+    for row in batch:
+        if row["thing_id"] not in table.index:
+            assert row == {"thing_id": "unknown", "peak": [], "off_peak": []}, (
+                f"PredictHoursBatch | Unknown machine is not empty: {row}"
+            )
+            continue
+        for key, peak in [("peak", True), ("off_peak", False)]:
+            single = table.predict_hours(
+                row["thing_id"], date, start_time, end_time, peak
+            )
+            assert row[key] == single, (
+                f"PredictHoursBatch | {row['thing_id']} {key} differs: "
+                f"{row[key]} {single}"
+            )
+
+
+def make_samples(minutes: int = 600, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range("2025-04-21", periods=minutes, freq="min", tz="UTC")
+    return pd.DataFrame(
+        {
+            "thing_id": np.repeat(["device-0", "device-1"], minutes),
+            "timestamp": np.tile(timestamps, 2),
+            "on": rng.random(2 * minutes) < 0.05,
+        }
+    )
+
+
+def read_slots(samples: pd.DataFrame, since, until) -> pd.DataFrame:
+    """
+    Slots of the samples with since < timestamp <= until, shaped like
+    get_machine_state_slots_df.
+    """
+    samples = samples[(samples["timestamp"] > since) & (samples["timestamp"] <= until)]
+    slots = (
+        pd.DataFrame(
+            {
+                "thing_id": pd.Categorical(samples["thing_id"]),
+                "slot": samples["timestamp"].dt.floor("30min"),
+                "is_on": samples["on"],
+            }
+        )
+        .groupby(["thing_id", "slot"], sort=True, observed=True)["is_on"]
+        .max()
+        .reset_index()
+    )
+    return slots
+
+
+def assert_same_slots(actual: pd.DataFrame, expected: pd.DataFrame, name: str):
+    actual = actual.reset_index(drop=True)
+    expected = expected.reset_index(drop=True)
+    for column in ["thing_id", "slot", "is_on"]:
+        assert actual[column].astype(str).tolist() == (
+            expected[column].astype(str).tolist()
+        ), f"{name} | {column} differs"
+
+
+def test_merge_slots_overlapping_window():
+    samples = make_samples()
+    start = samples["timestamp"].min() - pd.Timedelta(minutes=1)
+    end = samples["timestamp"].max()
+    watermark = start + pd.Timedelta(minutes=317)
+    overlap = pd.Timedelta(minutes=30)
+
+    # the only "on" sample of its slot is at the watermark, and the first run did
+    # not see it yet
+    device = samples["thing_id"] == "device-1"
+    slot = samples["timestamp"].dt.floor("30min") == watermark.floor("30min")
+    late = device & (samples["timestamp"] == watermark)
+    samples.loc[device & slot, "on"] = False
+    samples.loc[late, "on"] = True
+    first = read_slots(samples[~late], start, watermark)
+    full = read_slots(samples, start, end)
+
+    merged = merge_slots(first, read_slots(samples, watermark - overlap, end))
+    assert_same_slots(merged, full, "MergeSlotsOverlap")
+
+    # without the overlap the late sample's slot stays off
+    missed = merge_slots(first, read_slots(samples, watermark, end))
+    assert missed["is_on"].sum() == full["is_on"].sum() - 1, (
+        "MergeSlotsOverlap | Late sample was not missed without the overlap"
+    )
+
+
+def test_merge_slots_idempotent():
+    samples = make_samples()
+    start = samples["timestamp"].min() - pd.Timedelta(minutes=1)
+    middle = start + pd.Timedelta(minutes=300)
+    end = samples["timestamp"].max()
+
+    new = read_slots(samples, middle - pd.Timedelta(minutes=45), end)
+    once = merge_slots(read_slots(samples, start, middle), new)
+    assert_same_slots(once, read_slots(samples, start, end), "MergeSlotsIdempotent")
+    assert_same_slots(merge_slots(once, new), once, "MergeSlotsIdempotent")
+
+
+class MemoryBlob:
+    def __init__(self, blobs: dict, name: str):
+        self.blobs = blobs
+        self.name = name
+
+    def exists(self) -> bool:
+        return self.name in self.blobs
+
+    def upload_from_string(self, data, content_type=None):
+        self.blobs[self.name] = data.encode() if isinstance(data, str) else data
+
+    def download_as_bytes(self) -> bytes:
+        return self.blobs[self.name]
+
+
+class MemoryBucket:
+    """
+    The parts of a Cloud Storage bucket the registry uses, kept in a dict.
+    """
+
+    def __init__(self):
+        self.blobs = {}
+
+    def blob(self, name: str) -> MemoryBlob:
+        return MemoryBlob(self.blobs, name)
+
+    def get_blob(self, name: str):
+        return MemoryBlob(self.blobs, name) if name in self.blobs else None
+
+    def list_blobs(self, prefix: str) -> list:
+        return [self.blob(name) for name in self.blobs if name.startswith(prefix)]
+
+    def copy_blob(self, blob: MemoryBlob, bucket, name: str):
+        self.blobs[name] = self.blobs[blob.name]
+
+
+class MemoryClient:
+    def __init__(self, bucket: MemoryBucket):
+        self._bucket = bucket
+
+    def bucket(self, name: str) -> MemoryBucket:
+        return self._bucket
+
+
+def test_registry_pin_and_rollback(monkeypatch, tmp_path):
+    bucket = MemoryBucket()
+    monkeypatch.setattr(registry, "get_storage_client", lambda: MemoryClient(bucket))
+    model_registry = ModelRegistry(lambda: "bucket", "registry", str(tmp_path), 1 << 20)
+
+    serve = {"occupancy_table": "occupancy_table.npz"}
+    first = model_registry.publish(
+        "model.pkl", {"occupancy_table": b"first"}, serve=serve
+    )
+    second = model_registry.publish(
+        "model.pkl", {"occupancy_table": b"second"}, serve=serve
+    )
+    assert bucket.blobs["occupancy_table.npz"] == b"second", (
+        "RegistryPinRollback | Latest version is not served"
+    )
+
+    model_registry.rollback("model.pkl")
+    assert model_registry.version("model.pkl")["version"] == first["version"], (
+        "RegistryPinRollback | Rollback did not make the older version current"
+    )
+    assert bucket.blobs["occupancy_table.npz"] == b"first", (
+        "RegistryPinRollback | Rollback did not change the served table"
+    )
+
+    model_registry.pin("model.pkl", second["version"])
+    assert bucket.blobs["occupancy_table.npz"] == b"second", (
+        "RegistryPinRollback | Pin did not change the served table"
+    )
+    record = model_registry.version("model.pkl")
+    assert model_registry.fetch(record, "occupancy_table") == b"second", (
+        f"RegistryPinRollback | Fetched the wrong artifact for {record}"
+    )
+
+
+def fit_toy_model() -> RandomForestModel:
+    samples = make_samples(minutes=4 * 24 * 60)
+    model = RandomForestModel(load_model=False)
+    model.fit(
+        samples.assign(state=np.where(samples["on"], "on", "off"))[
+            ["thing_id", "state", "timestamp"]
+        ]
+    )
+    return model
+
+
+def test_flat_forest_matches_scikit_learn(monkeypatch):
+    # unbounded trees, deeper than the compacted ones
+    monkeypatch.setattr(model_module, "COMPACT_MODEL", False)
+    model = fit_toy_model()
+    grid = np.stack(
+        np.meshgrid([0, 1], np.arange(24), [0, 30], np.arange(7)), axis=-1
+    ).reshape(-1, 4)
+    expected = model.model.predict_proba(
+        pd.DataFrame(grid, columns=model.X_features)
+    )
+
+    flat = FlatForest.from_bytes(model.flat_forest().to_bytes())
+    assert np.array_equal(flat.predict_proba(grid), expected), (
+        "FlatForestMatchesScikitLearn | Probabilities differ"
+    )
+
+
+def test_occupancy_table_matches_model_predict_hours():
+    model = fit_toy_model()
+    table = model.occupancy_table()
+    date = "2025-04-24"
+    start_time, end_time = "2025-04-24T00:00:00", "2025-04-24T23:30:00"
+
+    for thing_id in table.thing_ids:
+        df = generate_prediction_data(thing_id, start_time, end_time)
+        for peak in [True, False]:
+            expected = model.predict_hours(df, date, start_time, end_time, peak)
+            actual = table.predict_hours(thing_id, date, start_time, end_time, peak)
+            assert len(actual) == 3 and actual == expected, (
+                f"OccupancyTableMatchesModel | {thing_id} peak={peak}: "
+                f"{actual} {expected}"
+            )
+
+
+def test_load_predicts_from_flat_forest(monkeypatch, tmp_path):
+    bucket = MemoryBucket()
+    monkeypatch.setattr(registry, "get_storage_client", lambda: MemoryClient(bucket))
+    monkeypatch.setattr(registry.model_registry, "cache_dir", str(tmp_path))
+    monkeypatch.setenv("MODEL_FILENAME", "model.pkl")
+    trained = fit_toy_model()
+    trained.save("model.pkl")
+
+    # only the flat forest is downloaded to predict
+    fetched = []
+    fetch = registry.model_registry.fetch
+    monkeypatch.setattr(
+        registry.model_registry,
+        "fetch",
+        lambda record, artifact="model": fetched.append(artifact)
+        or fetch(record, artifact),
+    )
+    loaded = RandomForestModel()
+    df = generate_prediction_data("device-1", "2025-04-24T06:00", "2025-04-24T18:00")
+    assert loaded.predict(df)["probability_on"].equals(
+        trained.predict(df)["probability_on"]
+    ), "LoadPredictsFromFlatForest | Probabilities differ"
+    assert fetched == ["flat_forest"], (
+        f"LoadPredictsFromFlatForest | Fetched {fetched}"
+    )
@@ -3,12 +3,18 @@
 usage() {
     echo "Usage: $0 --function <function_name> [parameters]"
     echo "Available functions:"
-    echo "  getStateTimeseries --thing_id <id> --start_time <time> --variable <var>"
+    echo "  getStateTimeseries --thing_id <id> --start_time <time> --variable <var> [--end_time <time>] [--limit <n>] [--cursor <cursor>]"
     echo "  getDeviceState --thing_id <id> --variable <var>"
     echo "  getPeakHours --thing_id <id> --date <date> --start_time <time> --end_time <time> --peak <true/false>"
+    echo "  getFleetPeakHours (--gym_id <id> | --thing_id <id>[,<id>...]) --date <date> --start_time <time> --end_time <time>"
+    echo "  getPeakHoursForecast (--gym_id <id> | --thing_id <id>[,<id>...]) --start_date <date> [--days <n>] [--count <n>]"
     echo "  getLastUsedTime --thing_id <id>"
     echo "  getLat --thing_id <id>"
     echo "  getLong --thing_id <id>"
+    echo "  getUsageSessions --thing_id <id> --start_time <time> [--end_time <time>]"
+    echo "  getUsageHeatmap --thing_id <id> [--start_time <time>] [--end_time <time>]"
+    echo "  getDailyUsageRange --thing_id <id> --start_date <date> --end_date <date>"
+    echo "  getMachineSnapshot --thing_id <id>[,<id>...]"
     echo "  email_on_available --thing_id <id> --variable <on/off>"
     exit 1
 }
@@ -26,6 +32,18 @@ while [[ $# -gt 0 ]]; do
             THING_ID="$2"
             shift 2
             ;;
+        --gym_id)
+            GYM_ID="$2"
+            shift 2
+            ;;
+        --days)
+            DAYS="$2"
+            shift 2
+            ;;
+        --count)
+            COUNT="$2"
+            shift 2
+            ;;
         --start_time)
             START_TIME="$2"
             shift 2
@@ -46,6 +64,22 @@ while [[ $# -gt 0 ]]; do
             PEAK="$2"
             shift 2
             ;;
+        --start_date)
+            START_DATE="$2"
+            shift 2
+            ;;
+        --end_date)
+            END_DATE="$2"
+            shift 2
+            ;;
+        --limit)
+            LIMIT="$2"
+            shift 2
+            ;;
+        --cursor)
+            CURSOR="$2"
+            shift 2
+            ;;
         *)
             echo "Unknown parameter: $1"
             usage
@@ -61,6 +95,15 @@ case "$FUNCTION" in
             usage
         fi
         URL="$API_BASE_URL/$FUNCTION?thing_id=$THING_ID&start_time=$START_TIME&variable=$VARIABLE"
+        if [ ! -z "$END_TIME" ]; then
+            URL="$URL&end_time=$END_TIME"
+        fi
+        if [ ! -z "$LIMIT" ]; then
+            URL="$URL&limit=$LIMIT"
+        fi
+        if [ ! -z "$CURSOR" ]; then
+            URL="$URL&cursor=$CURSOR"
+        fi
         ;;
     getDeviceState)
         if [ -z "$THING_ID" ] || [ -z "$VARIABLE" ]; then
@@ -79,6 +122,36 @@ case "$FUNCTION" in
             URL="$URL&peak=$PEAK"
         fi
         ;;
+    getFleetPeakHours)
+        if { [ -z "$GYM_ID" ] && [ -z "$THING_ID" ]; } || [ -z "$DATE" ] || [ -z "$START_TIME" ] || [ -z "$END_TIME" ]; then
+            echo "Missing required parameters for $FUNCTION"
+            usage
+        fi
+        URL="$API_BASE_URL/$FUNCTION?date=$DATE&start_time=$START_TIME&end_time=$END_TIME"
+        if [ ! -z "$GYM_ID" ]; then
+            URL="$URL&gym_id=$GYM_ID"
+        else
+            URL="$URL&thing_id=$THING_ID"
+        fi
+        ;;
+    getPeakHoursForecast)
+        if { [ -z "$GYM_ID" ] && [ -z "$THING_ID" ]; } || [ -z "$START_DATE" ]; then
+            echo "Missing required parameters for $FUNCTION"
+            usage
+        fi
+        URL="$API_BASE_URL/$FUNCTION?start_date=$START_DATE"
+        if [ ! -z "$GYM_ID" ]; then
+            URL="$URL&gym_id=$GYM_ID"
+        else
+            URL="$URL&thing_id=$THING_ID"
+        fi
+        if [ ! -z "$DAYS" ]; then
+            URL="$URL&days=$DAYS"
+        fi
+        if [ ! -z "$COUNT" ]; then
+            URL="$URL&count=$COUNT"
+        fi
+        ;;
     addTimeStep)
         URL="$API_BASE_URL/$FUNCTION"
         ;;
@@ -97,6 +170,35 @@ case "$FUNCTION" in
     getDailyUsage)
         URL="$API_BASE_URL/$FUNCTION?thing_id=$THING_ID&date=$DATE"
         ;;
+    getUsageSessions)
+        if [ -z "$THING_ID" ] || [ -z "$START_TIME" ]; then
+            echo "Missing required parameters for $FUNCTION"
+            usage
+        fi
+        URL="$API_BASE_URL/$FUNCTION?thing_id=$THING_ID&start_time=$START_TIME"
+        if [ ! -z "$END_TIME" ]; then
+            URL="$URL&end_time=$END_TIME"
+        fi
+        ;;
+    getUsageHeatmap)
+        URL="$API_BASE_URL/$FUNCTION?thing_id=$THING_ID"
+        if [ ! -z "$START_TIME" ]; then
+            URL="$URL&start_time=$START_TIME"
+        fi
+        if [ ! -z "$END_TIME" ]; then
+            URL="$URL&end_time=$END_TIME"
+        fi
+        ;;
+    getDailyUsageRange)
+        if [ -z "$THING_ID" ] || [ -z "$START_DATE" ] || [ -z "$END_DATE" ]; then
+            echo "Missing required parameters for $FUNCTION"
+            usage
+        fi
+        URL="$API_BASE_URL/$FUNCTION?thing_id=$THING_ID&start_date=$START_DATE&end_date=$END_DATE"
+        ;;
+    getMachineSnapshot)
+        URL="$API_BASE_URL/$FUNCTION?thing_id=$THING_ID"
+        ;;
     email_on_available)
         if [ -z "$THING_ID" ] || [ -z "$VARIABLE" ]; then
             echo "Missing required parameters for $FUNCTION"
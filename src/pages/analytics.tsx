@@ -6,7 +6,7 @@ import Footer from '@/components/footer';
 import Banner from '@/components/banner';
 import styles from '@/styles/index.module.css';
 import { HOME_STYLE } from '@/styles/customStyles';
-import { fetchGyms, fetchMachines, fetchDeviceState, fetchLastUsedTime, fetchPeakHours } from '@/utils/db';
+import { fetchGyms, fetchMachines, fetchDeviceState, fetchLastUsedTime, fetchFleetPeakHours } from '@/utils/db';
 import { useAuth } from '@/lib/auth';
 import { ONE_SECOND, EMAIL, STATUS_OFFLINE, STATUS_UNKNOWN, ONE_DAY, CACHE_PREFIX } from '@/utils/consts';
 import { RequireAuth } from '@/components/requireAuth';
@@ -502,35 +502,18 @@ function Analytics() {
       const peakTimesMap = { ...cachedPeakTimes };
       const idealTimesMap = { ...cachedIdealTimes };
       
-      console.log('[Analytics] Fetching peak times for machines:', machines.map(m => m.thing_id));
-      // fetch peak times for all machines
-      const peakTimesPromises = machines.map(machine => {
-        return fetchPeakHours(machine.thing_id, undefined, true);
-      });
-
-      const peakTimesResults = await Promise.all(peakTimesPromises);
-      console.log('[Analytics] Peak times results:', peakTimesResults);
-
-      machines.forEach((machine, index) => {
-        const result = peakTimesResults[index];
-        if (result && result.length > 0) {
-          peakTimesMap[machine.thing_id] = result;
+      console.log('[Analytics] Fetching peak and ideal times for machines:', machines.map(m => m.thing_id));
+      // fetch peak and ideal times for all machines in one request
+      const fleetTimes = await fetchFleetPeakHours(machines.map(machine => machine.thing_id));
+      console.log('[Analytics] Peak and ideal times results:', fleetTimes);
+
+      machines.forEach(machine => {
+        const result = fleetTimes[machine.thing_id];
+        if (result && result.peak.length > 0) {
+          peakTimesMap[machine.thing_id] = result.peak;
         }
-      });
-
-      console.log('[Analytics] Fetching ideal times for machines:', machines.map(m => m.thing_id));
-      // fetch ideal times for all machines
-      const idealTimesPromises = machines.map(machine => {
-        return fetchPeakHours(machine.thing_id, undefined, false);
-      });
-
-      const idealTimesResults = await Promise.all(idealTimesPromises);
-      console.log('[Analytics] Ideal times results:', idealTimesResults);
-
-      machines.forEach((machine, index) => {
-        const result = idealTimesResults[index];
-        if (result && result.length > 0) {
-          idealTimesMap[machine.thing_id] = result;
+        if (result && result.ideal.length > 0) {
+          idealTimesMap[machine.thing_id] = result.ideal;
         }
       });
 
@@ -467,4 +467,52 @@ export async function fetchPeakHours(
     console.error(`[API] Error fetching ${isPeak ? 'peak' : 'ideal'} hours for machine ${machineId}:`, error);
     return [];
   }
-}
\ No newline at end of file
+}
+
+// get peak and ideal hours predictions for several machines in one request
+export async function fetchFleetPeakHours(
+  machineIds: string[],
+  date: string = new Date().toISOString().split('T')[0]
+): Promise<{[key: string]: {peak: string[], ideal: string[]}}> {
+  try {
+    if (machineIds.length === 0) {
+      return {};
+    }
+    const startTime = `${date}T06:00:00.000Z`;
+    const endTime = `${date}T19:00:00.000Z`;
+
+    const params = new URLSearchParams({
+      date: date,
+      start_time: startTime,
+      end_time: endTime,
+      thing_id: machineIds.join(','),
+    });
+    const response = await fetch(`${API_ENDPOINT}/getFleetPeakHours?${params.toString()}`);
+
+    if (!response.ok) {
+      console.error('[API] Error fetching fleet peak hours:', response.statusText);
+      return {};
+    }
+
+    const data = await response.json();
+
+    // format the times to be more readable, same as fetchPeakHours
+    const format = (timestamps: string[]) => timestamps.map((timestamp: string) => {
+      const date = new Date(timestamp);
+      const hours = date.getUTCHours();
+      const minutes = date.getUTCMinutes().toString().padStart(2, '0');
+      const ampm = hours >= 12 ? 'PM' : 'AM';
+      const hours12 = hours % 12 || 12;
+      return `${hours12}:${minutes} ${ampm}`;
+    });
+
+    const result: {[key: string]: {peak: string[], ideal: string[]}} = {};
+    data.forEach((row: {thing_id: string, peak: string[], off_peak: string[]}) => {
+      result[row.thing_id] = { peak: format(row.peak), ideal: format(row.off_peak) };
+    });
+    return result;
+  } catch (error) {
+    console.error('[API] Error fetching fleet peak hours:', error);
+    return {};
+  }
+}